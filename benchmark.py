@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+import multiprocessing
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from coldData import *
+from synthetic import write_dat
+from profiling import peak_rss
+
+# the stages timed at each scale, in order, and what their throughput is counted in
+stageUnits = [("load", "waveforms"),
+              ("select", "selections"),
+              ("find_ledge", "waveforms"),
+              ("broadcast", "waveforms"),
+              ("fit_model", "fits")]
+
+def peak_height(wf):
+    "the height of a waveform's pulse above its baseline (the function timed by the broadcast stage)"
+    return np.max(wf.samples) - wf.baseline
+
+def synthetic_file(dataDir, nWaveforms, seed = 0):
+    "the synthetic data file with nWaveforms waveforms in dataDir, written the first time it is needed"
+    fileName = os.path.join(dataDir, "synthetic_" + str(nWaveforms) + "_" + str(seed) + ".dat")
+    if not os.path.exists(fileName):
+        if not os.path.isdir(dataDir):
+            os.makedirs(dataDir)
+        write_dat(fileName + ".part", nWaveforms, seed = seed)
+        os.rename(fileName + ".part", fileName)
+    return fileName
+
+def timed(results, stage, function, nItems, nBytes = 0, repeats = 1):
+    """
+    call function, adding a row for the stage to results, and return its value.
+    With repeats, it is called that many times and the fastest call is kept
+    """
+    seconds = np.inf
+    for attempt in range(repeats):
+        start = time.time()
+        value = function()
+        seconds = min(seconds, max(time.time() - start, 1e-9))
+    results.append({"stage": stage,
+                    "items": nItems,
+                    "seconds": seconds,
+                    "rate": nItems/seconds,
+                    "MBps": nBytes/2.**20/seconds,
+                    "peakMB": peak_rss()})
+    return value
+
+def run_scale(job):
+    """
+    time each stage on one synthetic file, returning one row per stage.
+    This runs in a fresh child process (see scale_process), so that peakMB is the peak memory
+    of this scale alone.
+    The stages which are cheap and leave nothing cached are repeated (see timed)
+    """
+    fileName, nWaveforms, executor = job
+    results = []
+
+    collection = timed(results, "load", dataFile(fileName).load, nWaveforms, os.path.getsize(fileName))
+
+    cells = [(chip, channel) for chip in collection.uniques["ID"] for channel in collection.uniques["channel"]]
+    timed(results, "select",
+          lambda: [collection[{"ID": chip, "channel": channel}] for chip, channel in cells],
+          len(cells), repeats = 5)
+
+    timed(results, "find_ledge", collection.find_ledge, collection.size, collection.samples.nbytes)
+
+    timed(results, "broadcast",
+          lambda: collection.broadcast(peak_height, executor = executor),
+          collection.size, collection.samples.nbytes, repeats = 5)
+
+    V = collection.uniques["ExtPulserMag"]
+    areas = collection.ledge_areas(search = False)
+    rows = areas["leftA"].reshape(-1, len(V))
+    bounds = [(None, 0), (None, None), (None, None)]
+    timed(results, "fit_model",
+          lambda: [fit_model(V, row, quadratic_model, [1, 1, 1], bounds = bounds) for row in rows],
+          len(rows), repeats = 3)
+
+    for row in results:
+        row["scale"] = nWaveforms
+    return results
+
+def scale_process(job, queue):
+    "run_scale in a child process, putting its rows (or the traceback of its error) on queue"
+    try:
+        queue.put(("rows", run_scale(job)))
+    except Exception:
+        queue.put(("error", traceback.format_exc()))
+
+def run(scales, dataDir, executor = "serial", seed = 0):
+    """
+    benchmark every stage at each scale (number of waveforms), returning all of the rows.
+    Each scale runs in its own child process, which is not a daemon (unlike the workers of
+    a Pool), so that the stages can start worker processes of their own
+    """
+    results = []
+    for nWaveforms in scales:
+        fileName = synthetic_file(dataDir, nWaveforms, seed)
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target = scale_process,
+                                          args = ((fileName, nWaveforms, executor), queue))
+        process.start()
+        try:
+            # the rows are taken before joining, so that the child is never left blocked on a full queue
+            while True:
+                try:
+                    kind, value = queue.get(timeout = 1)
+                    break
+                except Empty:
+                    if not process.is_alive() and queue.empty():
+                        raise RuntimeError("the benchmark of scale " + str(nWaveforms) +
+                                           " exited with code " + str(process.exitcode))
+        finally:
+            process.join()
+        if kind == "error":
+            raise RuntimeError("the benchmark of scale " + str(nWaveforms) + " failed:\n" + value)
+        results += value
+    return results
+
+def row_key(row):
+    return row["stage"] + "@" + str(row["scale"])
+
+def compare(results, baseline, tolerance = 0.2):
+    """
+    compare the throughput of each stage and scale with a baseline (the rows of an earlier run),
+    adding the ratio to each row.  Returns the rows more than tolerance slower than the baseline
+    """
+    baseRates = dict((row_key(row), row["rate"]) for row in baseline)
+    regressions = []
+    for row in results:
+        if row_key(row) in baseRates:
+            row["ratio"] = row["rate"]/baseRates[row_key(row)]
+            if row["ratio"] < 1 - tolerance:
+                regressions.append(row)
+    return regressions
+
+def report(results):
+    "print a table of the rows"
+    units = dict(stageUnits)
+    print "%-10s %9s %9s %12s %-11s %9s %9s %8s" % ("stage", "scale", "seconds", "rate", "", "MB/s", "peak MB", "ratio")
+    for row in results:
+        print "%-10s %9d %9.3f %12.1f %-11s %9.1f %9.1f %8s" % (row["stage"], row["scale"], row["seconds"], row["rate"],
+                                                               units[row["stage"]] + "/s", row["MBps"], row["peakMB"],
+                                                               "%.2f" % row["ratio"] if "ratio" in row else "")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "time the main analysis stages on synthetic data")
+    parser.add_argument("--scales", type = int, nargs = "+", default = [256, 1024, 4096],
+                        help = "numbers of waveforms")
+    parser.add_argument("--dataDir", default = "benchmarkData", help = "where the synthetic files are kept")
+    parser.add_argument("--executor", default = "serial", help = "executor of the broadcast stage")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--save", default = None, help = "save the results as a JSON baseline")
+    parser.add_argument("--compare", default = None, help = "compare with a saved JSON baseline")
+    parser.add_argument("--tolerance", type = float, default = 0.2,
+                        help = "fraction of the baseline throughput which may be lost before it is a regression")
+    args = parser.parse_args()
+
+    results = run(args.scales, args.dataDir, args.executor, args.seed)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            regressions = compare(results, json.load(baselineFile)["results"], args.tolerance)
+    report(results)
+
+    if args.save:
+        with open(args.save, "w") as baselineFile:
+            json.dump({"scales": args.scales, "results": results}, baselineFile, indent = 1)
+
+    if regressions:
+        print
+        print "regressions:", ", ".join(row_key(row) for row in regressions)
+        sys.exit(1)
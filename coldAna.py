@@ -1,6 +1,24 @@
+import os
+import shutil
+import tempfile
+import threading
+import multiprocessing
+import multiprocessing.pool
+
 import numpy as np
+import matplotlib.figure
+import matplotlib.patches
 import matplotlib.pyplot as plt
-import scipy.optimize as opt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+import scipy.ndimage as ndimage
+
+from collections import OrderedDict
+import utils
+from profiling import profiled
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 headerKeys = ["ID",              # unique string for each chip
               "chipType",        # v4, v7, v8, etc.
@@ -30,30 +48,631 @@ headerKeys = ["ID",              # unique string for each chip
               "N",               # int, number of sample in waveform
 ]
 
-class waveform:
+def header_table(columns, keys = headerKeys):
+    """
+    pack a dict of header columns (key: sequence of values, one per waveform)
+    into a structured array with one record per waveform, with fields in the order of keys
+    """
+    columns = [(key, np.asarray(columns[key])) for key in keys]
+    table = np.empty(len(columns[0][1]),
+                     dtype = [(key, column.dtype) for key, column in columns])
+    for key, column in columns:
+        table[key] = column
+
+    return table
+
+# settings of the ledge search (see find_ledges)
+ledgeParameters = {"smoothingWindow": 15,   # ticks, moving average of the derivative
+                   "noiseWindow": 30,       # ticks, window of the rolling standard deviation
+                   "noiseThreshold": 18,    # ADC counts, minimum rolling std of a peak
+                   "noisyFraction": 0.03,   # at most this fraction of the waveform may be noisier than a peak
+                   "searchStart": 400,      # ticks, peaks are only searched for after this
+                   "peakWindow": 150}       # ticks, half-width of the window around each peak
+
+# settings of the ledge pre-screen (see screen_ledges)
+screenParameters = {"screenFraction": 0.8}  # waveforms whose block std never reaches this fraction of noiseThreshold are not searched
+
+# settings of the pulse fit (see waveformCollection.fit_pulses)
+pulseFitParameters = {"before": 2.,             # peaking times before the peak where the fit starts
+                      "after": 8.,              # peaking times after the peak where it ends
+                      "defaultPeakingTime": 8.} # ticks, where the header has no nominal peaking time
+
+# the ADC takes a sample every 0.25 usec
+ticksPerMicrosecond = 4.
+
+def peaking_ticks(peakingTimes, default = pulseFitParameters["defaultPeakingTime"]):
+    """
+    the nominal peaking times decoded from the headers (strings like "2 usec") in ADC ticks,
+    or default where there is none, parsing each distinct string only once
+    """
+    values, inverse = np.unique(np.asarray(peakingTimes, dtype = str), return_inverse = True)
+    ticks = []
+    for value in values:
+        try:
+            ticks.append(float(value.split()[0])*ticksPerMicrosecond)
+        except (IndexError, ValueError):
+            ticks.append(default)
+    return np.array(ticks, dtype = float)[inverse]
+
+def pairwise_sum(term, n, start = 0):
+    """
+    sum the equally-shaped arrays term(start), ..., term(start + n - 1)
+    in the same order as numpy's pairwise summation, so that each element of
+    the result is exactly what np.sum would give for the corresponding n values
+    """
+    if n < 8:
+        result = 0.
+        for i in range(start, start + n):
+            result = result + term(i)
+    elif n <= 128:
+        partial = [term(start + k) for k in range(8)]
+        i = 8
+        while i < n - n % 8:
+            for k in range(8):
+                partial[k] = partial[k] + term(start + i + k)
+            i += 8
+        result = (((partial[0] + partial[1]) + (partial[2] + partial[3])) +
+                  ((partial[4] + partial[5]) + (partial[6] + partial[7])))
+        for i in range(start + i, start + n):
+            result = result + term(i)
+    else:
+        half = n//2
+        half -= half % 8
+        result = pairwise_sum(term, half, start) + pairwise_sum(term, n - half, start + half)
+
+    return result
+
+def rolling_std(samples, windowSize):
+    """
+    standard deviation of every windowSize-long window along the last axis of samples,
+    computed for all windows at once from shifted views of the samples.
+    result[..., i] is exactly np.std(samples[..., i:i + windowSize]).
+    This costs windowSize additions per tick rather than the few of a running (cumsum or
+    Welford) form, on purpose: find_ledges compares rolling stds for equality and ranks
+    them, so the last-bit differences of running sums would move ties and change which
+    ledges are found compared with the single-waveform search
+    """
+    x = np.asarray(samples, dtype = float)
+    nWindows = x.shape[-1] - windowSize + 1
+
+    def column(k):
+        return x[..., k:k + nWindows]
+
+    mean = pairwise_sum(column, windowSize)/windowSize
+    variance = pairwise_sum(lambda k: (column(k) - mean)**2, windowSize)/windowSize
+
+    return np.sqrt(variance)
+
+@profiled("find_ledge.rising")
+def smoothed_rising(samples, baselines, smoothingWindow):
+    """
+    whether the derivative of each row of samples (starting from its baseline),
+    smoothed by a smoothingWindow-long moving average, is not negative.
+    Ticks within half a window of either end count as rising
+    """
+    samples = np.asarray(samples, dtype = float)
+    baselines = np.asarray(baselines, dtype = float)
+    nTicks = samples.shape[1]
+
+    # np.convolve is called on each row, to round exactly as the single waveform version did
+    fringe = smoothingWindow//2
+    smoothingFilter = (1/float(smoothingWindow))*np.ones(smoothingWindow)
+    diff = np.diff(samples, n = 1, axis = 1, prepend = baselines[:, None])
+    rising = np.ones(samples.shape, dtype = bool)
+    for i in range(len(samples)):
+        smoothed = np.convolve(diff[i], smoothingFilter)[fringe:-fringe]
+        rising[i, fringe:nTicks - fringe] = smoothed[fringe:nTicks - fringe] >= 0
+
+    return rising
+
+@profiled("find_ledge.noise")
+def centred_noise(samples, noiseWindow):
+    "rolling std of each row of samples, centred on each tick and zero where the window does not fit"
+    samples = np.asarray(samples, dtype = float)
+    nTicks = samples.shape[1]
+    noise = np.zeros(samples.shape)
+    if nTicks > noiseWindow:
+        noise[:, noiseWindow//2:noiseWindow//2 + nTicks - noiseWindow] = rolling_std(samples, noiseWindow)[:, :-1]
+
+    return noise
+
+def no_ledges(nWaveforms):
+    "the result of find_ledges for nWaveforms waveforms without a ledge"
+    return {"hasLedge": np.zeros(nWaveforms, dtype = bool),
+            "leftLobe": np.zeros(nWaveforms, dtype = bool),
+            "rightLobe": np.zeros(nWaveforms, dtype = bool),
+            "ledgeEdge": np.zeros((nWaveforms, 2), dtype = int),
+            "zeroCrossing": np.full(nWaveforms, np.nan)}
+
+@profiled("find_ledge.screen")
+def screen_scores(samples, noiseWindow = ledgeParameters["noiseWindow"],
+                  searchStart = ledgeParameters["searchStart"]):
+    """
+    a cheap stand-in for the largest rolling std that find_ledges could see in each row of
+    samples: the largest std of the noiseWindow-long blocks from half a window before
+    searchStart on, with the blocks laid out twice, half a window apart.
+    This reads the samples twice, instead of the many passes and the sort of find_ledges
+    """
+    samples = np.asarray(samples, dtype = float)
+    nWaveforms, nTicks = samples.shape
+    first = max(searchStart - noiseWindow//2, 0)
+    scores = np.zeros(nWaveforms)
+    for start in (first, first + noiseWindow//2):
+        nBlocks = (nTicks - start)//noiseWindow
+        if nBlocks > 0:
+            blocks = samples[:, start:start + nBlocks*noiseWindow].reshape(nWaveforms, nBlocks, noiseWindow)
+            scores = np.maximum(scores, np.std(blocks, axis = 2).max(axis = 1))
+
+    return scores
+
+def screen_ledges(samples, screenFraction = screenParameters["screenFraction"], **parameters):
+    """
+    which rows of samples might have a ledge and have to be searched: the ones whose
+    screen_scores reach screenFraction of the noiseThreshold, using the settings in
+    ledgeParameters (overridden by keyword).  A ledge needs a rolling std above
+    noiseThreshold, so a lower screenFraction misses fewer ledges but lets more
+    clean waveforms through (see waveformCollection.calibrate_screen)
+    """
+    p = dict(ledgeParameters, **parameters)
+    return screen_scores(samples, p["noiseWindow"], p["searchStart"]) >= screenFraction*p["noiseThreshold"]
+
+@profiled("find_ledge.search")
+def find_ledges(samples, baselines, rising = None, noise = None, **parameters):
+    """
+    look for the ledge effect in a 2-D array of samples (one row per waveform)
+    with the given baselines, using the settings in ledgeParameters (overridden by keyword).
+
+    First-pass peaks are ticks after searchStart where the rolling std of the samples
+    is rising, above noiseThreshold and among the noisiest noisyFraction of the waveform.
+    Each is moved to the first maximum of the rolling std within peakWindow of it
+    where the smoothed derivative is not negative.  One distinct peak means only the
+    left lobe of the ledge was seen, two or more mean that both lobes were seen.
+
+    The smoothed derivative sign (see smoothed_rising) and the rolling std (see centred_noise)
+    are computed here unless they are given as rising and noise, e.g. from signalStats.
+
+    Returns a dict of arrays with one entry per row: hasLedge, leftLobe, rightLobe,
+    ledgeEdge (first and last peak, shape (rows, 2)) and zeroCrossing (nan without a ledge)
+    """
+    p = dict(ledgeParameters, **parameters)
+    samples = np.asarray(samples, dtype = float)
+    baselines = np.asarray(baselines, dtype = float)
+    nWaveforms, nTicks = samples.shape
+    ticks = np.arange(nTicks)
+
+    if rising is None:
+        rising = smoothed_rising(samples, baselines, p["smoothingWindow"])
+    if noise is None:
+        noise = centred_noise(samples, p["noiseWindow"])
+
+    # number of ticks in the same waveform with a larger rolling std
+    order = np.argsort(noise, axis = 1, kind = "mergesort")
+    ordered = np.take_along_axis(noise, order, axis = 1)
+    endsRun = np.ones(samples.shape, dtype = bool)
+    endsRun[:, :-1] = ordered[:, 1:] != ordered[:, :-1]
+    lastOfValue = np.minimum.accumulate(np.where(endsRun, ticks, nTicks)[:, ::-1], axis = 1)[:, ::-1]
+    nNoisier = np.empty(samples.shape, dtype = int)
+    np.put_along_axis(nNoisier, order, nTicks - 1 - lastOfValue, axis = 1)
+
+    # these are the first-pass peaks
+    noisyPeaks = ((ticks > p["searchStart"]) &
+                  (noise > p["noiseThreshold"]) &
+                  (nNoisier/float(nTicks) < p["noisyFraction"]) &
+                  (np.diff(noise, n = 1, axis = 1, prepend = 0) > 0))
+    rows, peakTicks = np.nonzero(noisyPeaks)
+
+    # look around each peak within a small window and take the first
+    # maximum of the noise in that window where the waveform is rising
+    halfWidth = p["peakWindow"]
+    windowMax = ndimage.maximum_filter1d(noise, 2*halfWidth - 1, axis = 1, mode = "nearest")
+    offsets = np.arange(1 - halfWidth, halfWidth)
+    found = np.zeros(len(rows), dtype = bool)
+    peaks = np.zeros(len(rows), dtype = int)
+    blockSize = 4096
+    for start in range(0, len(rows), blockSize):
+        theseRows = rows[start:start + blockSize, None]
+        theseTicks = peakTicks[start:start + blockSize, None]
+        win = theseTicks + offsets
+        inRange = (win >= 0) & (win < nTicks)
+        win = win.clip(0, nTicks - 1)
+        candidates = (inRange &
+                      (noise[theseRows, win] == windowMax[theseRows, theseTicks]) &
+                      rising[theseRows, win])
+        found[start:start + blockSize] = np.any(candidates, axis = 1)
+        peaks[start:start + blockSize] = win[np.arange(len(win)), np.argmax(candidates, axis = 1)]
+
+    # refined peaks never decrease along a waveform, so distinct peaks are changes in value
+    rows, peaks = rows[found], peaks[found]
+    isFirst = np.ones(len(rows), dtype = bool)
+    isFirst[1:] = rows[1:] != rows[:-1]
+    isLast = np.ones(len(rows), dtype = bool)
+    isLast[:-1] = rows[1:] != rows[:-1]
+    isNew = isFirst.copy()
+    isNew[1:] |= peaks[1:] != peaks[:-1]
+    nPeaks = np.bincount(rows[isNew], minlength = nWaveforms)
+
+    result = no_ledges(nWaveforms)
+    result["hasLedge"] = nPeaks >= 1
+    result["leftLobe"] = nPeaks >= 1
+    result["rightLobe"] = nPeaks >= 2
+    result["ledgeEdge"][rows[isFirst], 0] = peaks[isFirst]
+    result["ledgeEdge"][rows[isLast], 1] = peaks[isLast]
+
+    # the zero crossing is the median tick closest to the baseline after
+    # the first peak (and before the last one, if there are several)
+    ledges = np.flatnonzero(result["hasLedge"])
+    left = result["ledgeEdge"][ledges, 0]
+    right = np.where(result["rightLobe"][ledges], result["ledgeEdge"][ledges, 1], nTicks)
+    win = (ticks > left[:, None]) & (ticks < right[:, None])
+    distance = (samples[ledges] - baselines[ledges, None])**2
+    closest = np.where(win, distance, np.inf).min(axis = 1)
+    isMin = win & (distance == closest[:, None])
+    nMin = np.sum(isMin, axis = 1)
+    rank = np.cumsum(isMin, axis = 1)
+    lower = np.argmax(rank > ((nMin - 1)//2)[:, None], axis = 1)
+    upper = np.argmax(rank > (nMin//2)[:, None], axis = 1)
+    result["zeroCrossing"][ledges] = np.where(nMin > 0, (lower + upper)/2., np.nan)
+
+    return result
+
+def lobe_bounds(ledgeEdge, zeroCrossing):
+    """
+    tick ranges [start, stop) of the left lobe (strictly between the start of the ledge and
+    the zero crossing) and the right lobe (strictly between the zero crossing and the end of
+    the ledge), for arrays of ledgeEdge (shape (n, 2)) and zeroCrossing.  The zero crossing
+    may fall half way between two ticks.  Returns leftStart, leftStop, rightStart, rightStop;
+    the ranges are empty where there is no zero crossing
+    """
+    ledgeEdge = np.asarray(ledgeEdge, dtype = int).reshape(-1, 2)
+    zeroCrossing = np.asarray(zeroCrossing, dtype = float).reshape(-1)
+    valid = np.isfinite(zeroCrossing)
+    zeroCrossing = np.where(valid, zeroCrossing, 0)
+
+    leftStart = ledgeEdge[:, 0] + 1
+    leftStop = np.where(valid, np.maximum(np.ceil(zeroCrossing).astype(int), leftStart), leftStart)
+    rightStart = np.floor(zeroCrossing).astype(int) + 1
+    rightStop = np.where(valid, np.maximum(ledgeEdge[:, 1], rightStart), rightStart)
+
+    return leftStart, leftStop, rightStart, rightStop
+
+class signalStats(object):
+    """
+    Per-waveform statistics of the samples of a waveformStore which several analyses share
+    (prefix sums, rolling std, smoothed derivative sign).  Each is computed for a row
+    the first time it is asked for, in batches, and the most recently used (statistic, row)
+    pairs are kept, up to cacheBytes in all (by default about a chunk's worth of each statistic
+    for a few chunks of 4000-tick waveforms, so that chunked reads stay bounded in memory)
+    """
+    def __init__(self, store, cacheBytes = 32*2**20):
+        self.store = store
+        self.cacheBytes = cacheBytes
+        self.cache = OrderedDict()
+        self.cachedBytes = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        "the cache and its lock are left out when pickling"
+        return {"store": self.store, "cacheBytes": self.cacheBytes}
+
+    def __setstate__(self, state):
+        self.__init__(state["store"], state["cacheBytes"])
+
+    def memoized(self, name, positions, compute, tags = None):
+        """
+        the rows at positions of the statistic called name, as a 2-D array.
+        compute(positions) returns the rows which are not cached yet.  tags are
+        per-row values the statistic depends on besides the samples (e.g. the baseline)
+        """
+        positions = np.atleast_1d(np.asarray(positions, dtype = int))
+        if tags is None:
+            keys = [(name, position) for position in positions.tolist()]
+        else:
+            keys = [(name, position, tag) for position, tag in zip(positions.tolist(), np.atleast_1d(tags).tolist())]
+
+        # rows found in the cache are taken out while the others are computed, so that
+        # another thread can't evict them in the meantime
+        with self.lock:
+            cached = dict((i, self.cache.pop(key)) for i, key in enumerate(keys) if key in self.cache)
+            self.cachedBytes -= sum(row.nbytes for row in cached.values())
+        missing = [i for i in range(len(keys)) if not i in cached]
+        if missing:
+            # copied, so that a cached row doesn't keep the whole computed block alive
+            cached.update(zip(missing, [row.copy() for row in compute(positions[missing])]))
+        rows = [cached[i] for i in range(len(keys))]
+
+        with self.lock:
+            for key, row in zip(keys, rows):
+                if key in self.cache:
+                    self.cachedBytes -= self.cache.pop(key).nbytes
+                self.cache[key] = row
+                self.cachedBytes += row.nbytes
+            while self.cache and self.cachedBytes > self.cacheBytes:
+                self.cachedBytes -= self.cache.popitem(last = False)[1].nbytes
+
+        return np.array(rows)
+
+    def prefix_sums(self, positions):
+        """
+        cumulative sums of the samples of the rows at positions, with a leading zero,
+        so that the sum of samples[i:j] of a row is prefix[j] - prefix[i]
+        """
+        def compute(rows):
+            samples = np.asarray(self.store.samples[rows], dtype = float)
+            return np.concatenate((np.zeros((len(rows), 1)), np.cumsum(samples, axis = 1)), axis = 1)
+        return self.memoized("prefixSums", positions, compute)
+
+    def window_mean(self, positions, start, stop):
+        "the mean of samples[start:stop] of each of the rows at positions, from the prefix sums"
+        prefix = self.prefix_sums(positions)
+        return (prefix[:, stop] - prefix[:, start])/float(stop - start)
+
+    def noise(self, positions, noiseWindow = ledgeParameters["noiseWindow"]):
+        "the rolling std of the rows at positions (see centred_noise)"
+        return self.memoized(("noise", noiseWindow), positions,
+                             lambda rows: centred_noise(self.store.samples[rows], noiseWindow))
+
+    def rising(self, positions, smoothingWindow = ledgeParameters["smoothingWindow"]):
+        "the sign of the smoothed derivative of the rows at positions (see smoothed_rising)"
+        baselines = self.store.baseline
+        return self.memoized(("rising", smoothingWindow), positions,
+                             lambda rows: smoothed_rising(self.store.samples[rows], baselines[rows], smoothingWindow),
+                             tags = baselines[positions])
+
+    def lobe_areas(self, positions):
+        """
+        the sums of the baseline-subtracted samples over the left and right lobes of the
+        ledges found in the rows at positions (see lobe_bounds), from the prefix sums,
+        as two arrays.  The area of a lobe which was not found is 0
+        """
+        store = self.store
+        positions = np.atleast_1d(np.asarray(positions, dtype = int))
+        left = np.zeros(len(positions))
+        right = np.zeros(len(positions))
+
+        ledges = store.hasLedge[positions]
+        if np.any(ledges):
+            rows = positions[ledges]
+            prefix = self.prefix_sums(rows)
+            baselines = store.baseline[rows]
+            leftStart, leftStop, rightStart, rightStop = lobe_bounds(store.ledgeEdge[rows],
+                                                                     store.zeroCrossing[rows])
+            i = np.arange(len(rows))
+            leftArea = prefix[i, leftStop] - prefix[i, leftStart] - baselines*(leftStop - leftStart)
+            rightArea = prefix[i, rightStop] - prefix[i, rightStart] - baselines*(rightStop - rightStart)
+            left[ledges] = np.where(store.leftLobe[rows], leftArea, 0)
+            right[ledges] = np.where(store.rightLobe[rows], rightArea, 0)
+
+        return left, right
+
+    def find_ledges(self, positions, **parameters):
+        "find_ledges for the rows at positions, with the shared statistics"
+        p = dict(ledgeParameters, **parameters)
+        return find_ledges(self.store.samples[positions],
+                           self.store.baseline[positions],
+                           rising = self.rising(positions, p["smoothingWindow"]),
+                           noise = self.noise(positions, p["noiseWindow"]),
+                           **parameters)
+
+class waveformStore(object):
+    """
+    Columnar storage for a set of waveforms: a structured array of headers,
+    a 2-D (waveform, tick) array of samples and a single ticks array,
+    plus one array per analysis result (baseline, ledge features, ...).
+    A waveformCollection, all of its sub-collections and all of
+    their waveforms are views into the same store
+    """
+    resultColumns = ["baseline",
+                     "hasLedge",
+                     "leftLobe",
+                     "rightLobe",
+                     "ledgeEdge",
+                     "zeroCrossing"]
+
+    def __init__(self, headers, samples, samplesFile = None):
+        """
+        headers is a structured array with one record per waveform (see header_table)
+        and samples is an array of shape (len(headers), number of samples),
+        memory-mapped from the .npy file samplesFile if that is given.
+        The samples are kept in whatever type they come in (int16 from a cache, see
+        compact_samples), but waveform.samples and waveformCollection.samples are always float
+        """
+        self.headers = headers
+        self.samples = samples
+        self.samplesFile = samplesFile
+        self.size = len(headers)
+
+        self.ticks = np.arange(samples.shape[1])
+        self.stats = signalStats(self)
+
+        # the baselines are found the first time they are needed
+        self.baselineValues = None
+
+        self.hasLedge = np.zeros(self.size, dtype = bool)
+        self.leftLobe = np.zeros(self.size, dtype = bool)
+        self.rightLobe = np.zeros(self.size, dtype = bool)
+        self.ledgeEdge = np.zeros((self.size, 2), dtype = int)
+        self.zeroCrossing = np.full(self.size, np.nan)
+
+        # inverted indexes of the header fields, built as they are needed
+        self.indexes = {}
+
+    @property
+    def baseline(self):
+        "baseline of each waveform, by default the mean of the first 5% of its samples (the sideband)"
+        if self.baselineValues is None:
+            sidebandEnd = int(0.05*self.samples.shape[1])
+            self.baselineValues = np.mean(self.samples[:, :sidebandEnd], axis = 1)
+        return self.baselineValues
+
+    @baseline.setter
+    def baseline(self, values):
+        self.baselineValues = values
+
+    def record_ledges(self, positions, result):
+        "save the result of find_ledges for the waveforms at the given rows"
+        for column in ["hasLedge", "leftLobe", "rightLobe", "ledgeEdge", "zeroCrossing"]:
+            getattr(self, column)[positions] = result[column]
+
+    def inverted_index(self, key):
+        """
+        index of a header field, built on first use: returns (values, codes, rows)
+        where values are the sorted unique values of the field, codes[i] is the
+        position in values of row i and rows[j] is the sorted array of rows with values[j]
+        """
+        if not key in self.indexes:
+            values, codes = np.unique(self.headers[key], return_inverse = True)
+            order = np.argsort(codes, kind = "mergesort")
+            bounds = np.cumsum(np.bincount(codes, minlength = len(values)))[:-1]
+            self.indexes[key] = (values, codes, np.split(order, bounds))
+
+        return self.indexes[key]
+
+    def lookup(self, key, value):
+        "the sorted array of rows whose header field key is equal to value"
+        values, codes, rows = self.inverted_index(key)
+        try:
+            i = np.searchsorted(values, value)
+            if i < len(values) and values[i] == value:
+                return rows[i]
+        except (TypeError, ValueError):
+            pass
+
+        return np.array([], dtype = int)
+
+    @staticmethod
+    def concatenate(pieces):
+        """
+        build a new store from a list of (store, positions) pairs,
+        copying the headers, samples and analysis results of those rows.
+        Only the header fields common to all of the stores are kept
+        """
+        keys = [key for key in pieces[0][0].headers.dtype.names
+                if all(key in store.headers.dtype.names for store, positions in pieces)]
+        headers = header_table({key: np.concatenate([store.headers[key][positions]
+                                                     for store, positions in pieces])
+                                for key in keys},
+                               keys)
+        samples = np.concatenate([store.samples[positions]
+                                  for store, positions in pieces])
+
+        result = waveformStore(headers, samples)
+        for column in waveformStore.resultColumns:
+            setattr(result, column, np.concatenate([getattr(store, column)[positions]
+                                                    for store, positions in pieces]))
+
+        return result
+
+class waveform(object):
+    """
+    A single waveform, which is a lightweight view of one row of a waveformStore
+    """
+    __slots__ = ["store", "index"]
+
     def __init__(self, header, data):
         """
         Initialize a waveform object
         from a header (dict of header fields and their values)
         and data (iterable containing ADC measurements)
         """
-        self.header = header
-        
-        self.samples = data
+        data = np.asarray(data)
+        keys = ([key for key in headerKeys if key in header] +
+                sorted(key for key in header if not key in headerKeys))
+        headers = header_table({key: [header[key]] for key in keys}, keys)
+
+        self.store = waveformStore(headers, data.reshape(1, -1))
+        self.index = 0
+
+    @classmethod
+    def view(cls, store, index):
+        "the waveform stored at a given row of a waveformStore, without copying anything"
+        wf = cls.__new__(cls)
+        wf.store = store
+        wf.index = index
+        return wf
+
+    @property
+    def header(self):
+        "dict of header fields and their values"
+        headers = self.store.headers
+        return dict(zip(headers.dtype.names, headers[self.index].item()))
+
+    @property
+    def samples(self):
+        "array of ADC samples, as floats whatever type the store keeps them in"
+        return np.asarray(self.store.samples[self.index], dtype = float)
+
+    @property
+    def ticks(self):
+        return self.store.ticks
+
+    @property
+    def baseline(self):
+        return self.store.baseline[self.index]
+
+    @baseline.setter
+    def baseline(self, value):
+        self.store.baseline[self.index] = value
+
+    @property
+    def hasLedge(self):
+        return bool(self.store.hasLedge[self.index])
+
+    @hasLedge.setter
+    def hasLedge(self, value):
+        self.store.hasLedge[self.index] = value
 
-        self.ticks = np.arange(len(data))
+    @property
+    def leftLobe(self):
+        return bool(self.store.leftLobe[self.index])
+
+    @leftLobe.setter
+    def leftLobe(self, value):
+        self.store.leftLobe[self.index] = value
+
+    @property
+    def rightLobe(self):
+        return bool(self.store.rightLobe[self.index])
+
+    @rightLobe.setter
+    def rightLobe(self, value):
+        self.store.rightLobe[self.index] = value
+
+    @property
+    def ledgeEdge(self):
+        "[start] of the ledge, or [start, end] if the right lobe was found too"
+        if not self.hasLedge:
+            return None
+        edge = self.store.ledgeEdge[self.index]
+        if self.rightLobe:
+            return [edge[0], edge[1]]
+        else:
+            return [edge[0]]
+
+    @ledgeEdge.setter
+    def ledgeEdge(self, value):
+        if value is not None:
+            self.store.ledgeEdge[self.index] = [value[0], value[-1]]
+
+    @property
+    def zeroCrossing(self):
+        if not self.hasLedge:
+            return None
+        return self.store.zeroCrossing[self.index]
+
+    @zeroCrossing.setter
+    def zeroCrossing(self, value):
+        if value is not None:
+            self.store.zeroCrossing[self.index] = value
 
-        # assumes that sideband ends 5% of the way into the waveform
-        self.calc_baseline(int(0.05*len(data)))
-        
     def calc_baseline(self, sidebandEnd):
         "Calculate baseline by a simple mean in a region outside of the main pulse"
-        self.baseline = np.mean(self.samples[self.ticks < sidebandEnd])
+        self.baseline = self.store.stats.window_mean([self.index], 0, min(sidebandEnd, len(self.ticks)))[0]
 
     def scatter(self, ax = plt, **kwargs):
         "Scatter plot the ADC samples to given axes, passing other keyword args unchanged"
         ax.scatter(self.ticks, self.samples, **kwargs)
 
+    @profiled("plot")
     def plot(self, ax = plt, savefig = False, outDir = "./", ext = "png"):
         "Plot the ADC samples to given axes, with ledge features highlighted"
         pulserMag = self.header['ExtPulserMag']
@@ -64,29 +683,27 @@ class waveform:
     
         plt.plot(self.ticks, self.samples)
         plt.axhline(y = self.baseline, color = 'g', ls = '--')
-        if "hasLedge" in dir(self):
-            if self.hasLedge:
-                if self.leftLobe:
-                    plt.axvline(x = self.ledgeEdge[0], color = 'r', ls = '--')
-                    plt.axvline(x = self.zeroCrossing, color = 'b', ls = '--')
-                    plt.fill_between(self.ticks,
-                                     self.samples,
-                                     self.baseline,
-                                     where = ((self.ticks > self.ledgeEdge[0]) &
-                                              (self.ticks < self.zeroCrossing)),
-                                     hatch = '////',
-                                     edgecolor = '#1f77b4',
-                                     facecolor = 'w')
-                if self.rightLobe:
-                    plt.axvline(x = self.ledgeEdge[1], color = 'r', ls = '--')
-                    plt.fill_between(self.ticks,
-                                     self.samples,
-                                     self.baseline,
-                                     where = ((self.ticks > self.zeroCrossing) &
-                                              (self.ticks < self.ledgeEdge[1])),
-                                     hatch = '\\\\\\\\',
-                                     edgecolor = '#ff7f0e',
-                                     facecolor = 'w')
+        if self.hasLedge:
+            leftStart, leftStop, rightStart, rightStop = [bound[0] for bound in
+                                                          lobe_bounds(self.store.ledgeEdge[self.index],
+                                                                      self.zeroCrossing)]
+            if self.leftLobe:
+                plt.axvline(x = self.ledgeEdge[0], color = 'r', ls = '--')
+                plt.axvline(x = self.zeroCrossing, color = 'b', ls = '--')
+                plt.fill_between(self.ticks[leftStart:leftStop],
+                                 self.samples[leftStart:leftStop],
+                                 self.baseline,
+                                 hatch = '////',
+                                 edgecolor = '#1f77b4',
+                                 facecolor = 'w')
+            if self.rightLobe:
+                plt.axvline(x = self.ledgeEdge[1], color = 'r', ls = '--')
+                plt.fill_between(self.ticks[rightStart:rightStop],
+                                 self.samples[rightStart:rightStop],
+                                 self.baseline,
+                                 hatch = '\\\\\\\\',
+                                 edgecolor = '#ff7f0e',
+                                 facecolor = 'w')
     
         plt.xlim(0, np.max(self.ticks))
         plt.ylim(self.baseline - 1000, self.baseline + 1000)
@@ -110,128 +727,283 @@ class waveform:
             plt.show()
 
 
-    def fit_model(self, model, x0, ax = plt, **plotkwargs):
+    def fit_model(self, model, x0, ax = plt, bounds = None, **plotkwargs):
         """
-        fit a given function of the form f(t, c1, c2, ...) with initial guess values for c1, c2...,
-        then plot to given axes, passing other keyword args unchanged
+        fit a given function of the form f(t, c1, c2, ...) with initial guess values for c1, c2...
+        (see utils.fit_model), then plot to given axes, passing other keyword args unchanged.
+        The model may be written for arrays of t or for one t at a time (see utils.array_model).
+        Nothing is plotted if ax is None
         """
-        def chi2(args):
-            return sum((model(xi, *args) - yi)**2 for xi, yi in zip(self.ticks, self.samples))
+        bfargs = utils.fit_model(self.ticks, self.samples, model, x0, bounds = bounds)
 
-        bfargs = opt.fmin_l_bfgs_b(chi2, x0, approx_grad = True)[0]
-        print bfargs
-
-        ax.plot(self.ticks, model(self.ticks, *bfargs), **plotkwargs)
+        if ax is not None:
+            ax.plot(self.ticks, utils.array_model(model, self.ticks, bfargs)(self.ticks, *bfargs), **plotkwargs)
 
         return bfargs
 
-    def find_ledge(self):
+    def lobe_areas(self):
+        """
+        the areas (sums of baseline-subtracted samples) of the left and right lobes of
+        the ledge, from the last find_ledge; 0 for a lobe which was not found
+        """
+        left, right = self.store.stats.lobe_areas([self.index])
+        return left[0], right[0]
+
+    @profiled("find_ledge")
+    def find_ledge(self, **parameters):
         """
         try to find the ledge effect within the waveform
         do this by peak finding.  Every waveform should have one positive peak
         a waveform where the ledge effect is present will also have 
         another positive peak and a negative peak
+        (see find_ledges for the algorithm and ledgeParameters for its settings)
         """
-        
-        # first, smooth the waveform out by convolution
-        window_size = 15
-        fringe_size = window_size/2
-        filter = (1/float(window_size))*np.ones(window_size)
-        diff = np.diff(self.samples, n = 1, prepend = self.baseline)
-        smoothed = np.convolve(diff,
-                               filter)[fringe_size:-fringe_size]
-        for i in range(fringe_size):
-            smoothed[i] = 0
-            smoothed[-i-1] = 0
-
-        diffThresh = 8
-        diffThresh = 4
-
-        noise = []
-        noiseWindowSize = 30
-        for i in range(len(self.samples) - noiseWindowSize):
-            windowNoise = np.std(self.samples[i:i+noiseWindowSize])
-            noise.append(windowNoise)
-        noise = np.array(noiseWindowSize/2*[0] + noise + noiseWindowSize/2*[0])
-
-        P = (np.array([np.sum((noise < ni for ni in noise), dtype = float)])/float(len(noise)))[0,:]
-        # these are the first-pass peaks
-        noisyPeaks = self.ticks[(self.ticks > 400) &
-                                (noise > 18) &
-                                # (noise > 0.4*np.max(noise[self.ticks > 400])) &
-                                (P < 0.03) &
-                                (np.diff(noise, n = 1, prepend = 0) > 0)]
-        peaks = []
-        for nP in noisyPeaks:
-            # look around each peak within a small window
-            # add the maximum within that window to peaks
-            winSize = 150
-            win = abs(self.ticks - nP) < winSize
-            candidatePeaks = sorted(self.ticks[(noise == np.max(noise[win])) &
-                                               (smoothed >= 0) & 
-                                               (win)])
-            if candidatePeaks:
-                if not candidatePeaks[0] in peaks:
-                    peaks.append(candidatePeaks[0])
-                    
-        if len(peaks) == 1:
-            self.hasLedge = True
-            self.leftLobe = True
-            self.rightLobe = False
-            self.ledgeEdge = peaks
-
-            win = self.ticks > peaks[0]
-            isMin = ((self.samples - self.baseline)**2 == np.min((self.samples[win] - self.baseline)**2))
-            self.zeroCrossing = np.median(self.ticks[win & isMin])
-        elif len(peaks) >= 2:
-            self.hasLedge = True
-            self.leftLobe = True
-            self.rightLobe = True
-            self.ledgeEdge = [peaks[0], peaks[-1]]
-
-            win = (self.ticks > peaks[0]) & (self.ticks < peaks[-1])
-            isMin = ((self.samples - self.baseline)**2 == np.min((self.samples[win] - self.baseline)**2))
-            self.zeroCrossing = np.median(self.ticks[win & isMin])
+        self.store.record_ledges([self.index],
+                                 self.store.stats.find_ledges([self.index], **parameters))
+
+
+def plot_file_name(header, outDir = "./", ext = "png"):
+    "where a batch plot of the waveform with this header is saved: outDir/chip/channel/chip_channel_pulserMag_.ext"
+    chip = str(header['ID'])
+    channel = str(header['channel'])
+    return os.path.join(outDir, chip, channel,
+                        "_".join([chip, channel, str(header['ExtPulserMag']), "." + ext]))
+
+class waveformPlotter(object):
+    """
+    draws waveforms in the style of waveform.plot on a figure of its own, using the Agg
+    backend directly instead of pyplot.  The figure and its artists are made once and
+    only their data is changed from one waveform to the next, so that many plots can be
+    saved quickly
+    """
+    def __init__(self, figsize = None, dpi = None):
+        self.figure = matplotlib.figure.Figure(figsize = figsize, dpi = dpi)
+        FigureCanvasAgg(self.figure)
+        ax = self.ax = self.figure.add_subplot(111)
+
+        self.trace, = ax.plot([], [])
+        self.baseline = ax.axhline(y = 0, color = 'g', ls = '--')
+        self.ledgeStart = ax.axvline(x = 0, color = 'r', ls = '--')
+        self.zeroCrossing = ax.axvline(x = 0, color = 'b', ls = '--')
+        self.ledgeEnd = ax.axvline(x = 0, color = 'r', ls = '--')
+        self.leftLobe = ax.add_patch(matplotlib.patches.Polygon(np.zeros((1, 2)),
+                                                                hatch = '////',
+                                                                edgecolor = '#1f77b4',
+                                                                facecolor = 'w'))
+        self.rightLobe = ax.add_patch(matplotlib.patches.Polygon(np.zeros((1, 2)),
+                                                                 hatch = '\\\\\\\\',
+                                                                 edgecolor = '#ff7f0e',
+                                                                 facecolor = 'w'))
+
+        ax.set_xlabel(r'Time [ADC ticks]')
+        ax.set_ylabel(r'ADC output')
+        self.rampLabel = ax.text(2500, 0, "Ramp Voltage:")
+        self.rampValue = ax.text(2750, 0, "")
+        self.title = ax.set_title("Chip: , Channel ")
+        self.figure.tight_layout()
+
+    def lobe(self, patch, wf, start, stop):
+        "shade the samples between ticks start and stop down to the baseline"
+        ticks = wf.ticks[start:stop]
+        if len(ticks):
+            patch.set_xy(np.column_stack((np.concatenate((ticks, ticks[::-1])),
+                                          np.concatenate((wf.samples[start:stop],
+                                                          np.full(len(ticks), wf.baseline))))))
         else:
-            self.hasLedge = False
-            self.leftLobe = False
-            self.rightLobe = False
-            self.ledgeEdge = None
-            self.zeroCrossing = None
+            patch.set_visible(False)
+
+    def draw(self, wf):
+        "update the artists to show a waveform"
+        baseline = wf.baseline
+        self.trace.set_data(wf.ticks, wf.samples)
+        self.baseline.set_ydata([baseline, baseline])
+
+        leftLobe = wf.hasLedge and wf.leftLobe
+        rightLobe = wf.hasLedge and wf.rightLobe
+        for artist in [self.ledgeStart, self.zeroCrossing, self.leftLobe]:
+            artist.set_visible(leftLobe)
+        for artist in [self.ledgeEnd, self.rightLobe]:
+            artist.set_visible(rightLobe)
+        if wf.hasLedge:
+            edge = wf.store.ledgeEdge[wf.index]
+            leftStart, leftStop, rightStart, rightStop = [bound[0] for bound in
+                                                          lobe_bounds(edge, wf.zeroCrossing)]
+            self.ledgeStart.set_xdata([edge[0], edge[0]])
+            self.zeroCrossing.set_xdata([wf.zeroCrossing, wf.zeroCrossing])
+            self.ledgeEnd.set_xdata([edge[1], edge[1]])
+            self.lobe(self.leftLobe, wf, leftStart, leftStop)
+            self.lobe(self.rightLobe, wf, rightStart, rightStop)
+
+        self.ax.set_xlim(0, np.max(wf.ticks))
+        self.ax.set_ylim(baseline - 1000, baseline + 1000)
+        self.rampLabel.set_position((2500, baseline + 750))
+        self.rampValue.set_position((2750, baseline + 550))
+        self.rampValue.set_text(str(wf.header['ExtPulserMag']) + " V")
+        self.title.set_text("Chip: " + str(wf.header['ID']) + ", Channel " + str(wf.header['channel']))
+
+    @profiled("plot.batch")
+    def save(self, wf, fileName):
+        "draw a waveform and save the figure to fileName"
+        self.draw(wf)
+        self.figure.savefig(fileName)
+
+# one waveformPlotter for each thread (or process) saving plots
+plotters = threading.local()
+
+def save_waveform_plot(wf, outDir = "./", ext = "png"):
+    "save a plot of a waveform to plot_file_name with this thread's waveformPlotter, returning the file name"
+    if not hasattr(plotters, "plotter"):
+        plotters.plotter = waveformPlotter()
+    fileName = plot_file_name(wf.header, outDir, ext)
+    plotters.plotter.save(wf, fileName)
+    return fileName
 
+def in_sorted(values, sortedArray):
+    "boolean mask of which values are present in sortedArray"
+    if not len(sortedArray):
+        return np.zeros(len(values), dtype = bool)
+    where = np.searchsorted(sortedArray, values).clip(max = len(sortedArray) - 1)
+    return sortedArray[where] == values
 
-class waveformCollection:
-    def __init__(self, waveformList):
-        "initialize from a list of waveform objects"
+class headerUniques(Mapping):
+    """
+    the unique values of each header field in a collection,
+    acting like a dict but only computing the values of a field when it is first requested
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self.cache = {}
+
+    def __getitem__(self, key):
+        if not key in self.collection.store.headers.dtype.names:
+            raise KeyError(key)
+        if not key in self.cache:
+            self.cache[key] = self.collection.unique_values(key)
+        return self.cache[key]
+
+    def __iter__(self):
+        return iter(self.collection.store.headers.dtype.names)
+
+    def __len__(self):
+        return len(self.collection.store.headers.dtype.names)
+
+class waveformCollection(object):
+    def __init__(self, waveformList = None, store = None, positions = None):
+        """
+        initialize from a list of waveform objects, or from a waveformStore
+        and the positions (rows) of this collection's waveforms within it (default: all rows)
+        """
+        if store is None:
+            store, positions = self.store_from_list(waveformList or [])
+        if positions is None:
+            positions = np.arange(store.size)
 
-        self.waveforms = waveformList
-        self.size = len(waveformList)
-        
-        self.uniques = {key: np.unique([wf.header[key] for wf in self.waveforms])
-                        for key in headerKeys}
+        self.store = store
+        self.positions = np.asarray(positions, dtype = int)
+        self.size = len(self.positions)
+        # does this collection cover the whole store, in order?
+        self.whole = (self.size == store.size and
+                      np.all(self.positions == np.arange(self.size)))
 
+        self.uniques = headerUniques(self)
+
+    @staticmethod
+    def store_from_list(waveformList):
+        """
+        find the store and positions backing a list of waveforms.
+        If they do not all live in the same store, their rows are copied into a new one
+        """
+        if not waveformList:
+            return waveformStore(header_table({key: [] for key in headerKeys}),
+                                 np.empty((0, 0))), []
+
+        stores = []
+        pieces = []
+        for wf in waveformList:
+            if stores and stores[-1] is wf.store:
+                pieces[-1].append(wf.index)
+            else:
+                stores.append(wf.store)
+                pieces.append([wf.index])
+
+        if all(store is stores[0] for store in stores):
+            return stores[0], [wf.index for wf in waveformList]
+        else:
+            return waveformStore.concatenate(zip(stores, pieces)), None
+
+    def rows(self, array):
+        "the rows of a per-waveform store array which belong to this collection"
+        if self.whole:
+            return array
+        return array[self.positions]
+
+    def column(self, key):
+        "array of the values of a header field, one per waveform"
+        return self.rows(self.store.headers[key])
+
+    def unique_values(self, key):
+        "sorted unique values of a header field, read from the store's index"
+        values, codes, rows = self.store.inverted_index(key)
+        if self.whole:
+            return values
+        return values[np.bincount(codes[self.positions], minlength = len(values)) > 0]
+
+    @property
+    def headers(self):
+        "structured array of the headers, one record per waveform"
+        return self.rows(self.store.headers)
+
+    @property
+    def samples(self):
+        """
+        2-D array of ADC samples, one row per waveform, as floats whatever type the store
+        keeps them in.  Samples memory-mapped from a cache are read into memory by this
+        """
+        return np.asarray(self.rows(self.store.samples), dtype = float)
+
+    @property
+    def ticks(self):
+        return self.store.ticks
+
+    @property
+    def baselines(self):
+        return self.rows(self.store.baseline)
+
+    @property
+    def waveforms(self):
+        "list of the waveform objects in this collection"
+        return [waveform.view(self.store, index) for index in self.positions]
+
+    def __len__(self):
+        return self.size
+
+    @profiled("select")
     def __getitem__(self, selectionHeader):
         """ 
         takes a dict of header key: value pairs and returns a subset
         of waveforms whose headers match the supplied header fields
         """
 
-        subSet = []
-
-        for wf in self:
-            if all(wf.header[key] == value
-                   for key, value in selectionHeader.items()):
-                subSet.append(wf)
+        # intersect the index entries of each field, starting from the smallest
+        matches = sorted((self.store.lookup(key, value)
+                          for key, value in selectionHeader.items()),
+                         key = len)
+        if self.whole and matches:
+            positions = matches.pop(0)
+        else:
+            positions = self.positions
+        for rows in matches:
+            positions = positions[in_sorted(positions, rows)]
 
-        return waveformCollection(subSet)
+        return waveformCollection(store = self.store, positions = positions)
 
     def __iter__(self):
         """
         iterating through the collection should just
         iterate through the individual waveforms
         """
-        for wf in self.waveforms:
-            yield wf
+        for index in self.positions:
+            yield waveform.view(self.store, index)
 
     def byHeaderCol(self, key):
         """
@@ -240,33 +1012,603 @@ class waveformCollection:
         and yield (value, waveformCollection) pairs
         """
 
-        for value in self.uniques[key]:
-            selectionHeader = {key: value}
-            yield value, self[selectionHeader]
+        values, codes, rows = self.store.inverted_index(key)
+        if self.whole:
+            groups = rows
+        else:
+            # group this collection's positions by the store's codes in one pass
+            theseCodes = codes[self.positions]
+            order = np.argsort(theseCodes, kind = "mergesort")
+            bounds = np.cumsum(np.bincount(theseCodes, minlength = len(values)))[:-1]
+            groups = np.split(self.positions[order], bounds)
+
+        for value, group in zip(values, groups):
+            if len(group):
+                yield value, waveformCollection(store = self.store, positions = group)
+
+    def query(self):
+        """
+        start a lazy query over the collection (see waveformQuery),
+        e.g. wfc.query().filter(socket = 1).group_by("ExtPulserMag").map(f).aggregate("mean").execute()
+        """
+        return waveformQuery(self)
+
+    @profiled("find_ledge")
+    def find_ledge(self, chunkSize = 64, screen = False, **parameters):
+        """
+        search every waveform in the collection for the ledge effect at once
+        (see waveform.find_ledge), chunkSize waveforms at a time.
+        If screen is True, each chunk is pre-screened first (see screen_ledges, with
+        screenFraction given along with the other settings if needed) and only the
+        waveforms which pass are searched, the others being recorded as having no ledge.
+        Returns a dict of how many waveforms each stage handled: screened, searched and found
+        """
+        screenFraction = parameters.pop("screenFraction", screenParameters["screenFraction"])
+        counts = OrderedDict([("screened", 0), ("searched", 0), ("found", 0)])
+        for start in range(0, self.size, chunkSize):
+            positions = self.positions[start:start + chunkSize]
+            if screen:
+                passed = screen_ledges(self.store.samples[positions], screenFraction, **parameters)
+                self.store.record_ledges(positions[~passed], no_ledges(np.sum(~passed)))
+                counts["screened"] += len(positions)
+                positions = positions[passed]
+            if len(positions):
+                result = self.store.stats.find_ledges(positions, **parameters)
+                self.store.record_ledges(positions, result)
+                counts["searched"] += len(positions)
+                counts["found"] += np.sum(result["hasLedge"])
+
+        return counts
+
+    def calibrate_screen(self, sampleSize = 1024, falseNegativeRate = 0.001, seed = 0, **parameters):
+        """
+        measure the ledge pre-screen (see screen_ledges) against the full search on a random
+        sample of sampleSize waveforms of the collection, whose ledges are found (and recorded)
+        as usual.  Returns a dict with the largest screenFraction which misses at most
+        falseNegativeRate of the ledges in the sample, the number of ledges in the sample,
+        how many of them that screenFraction misses and the fraction of the sample it would
+        not search.  Without any ledges in the sample, screenParameters is returned unchanged
+        """
+        p = dict(ledgeParameters, **parameters)
+        rng = np.random.RandomState(seed)
+        rows = np.sort(rng.choice(self.size, min(sampleSize, self.size), replace = False))
+        sample = waveformCollection(store = self.store, positions = self.positions[rows])
+        sample.find_ledge(**parameters)
+
+        hasLedge = sample.rows(self.store.hasLedge)
+        scores = screen_scores(sample.samples, p["noiseWindow"], p["searchStart"])/p["noiseThreshold"]
+        if np.any(hasLedge):
+            ledgeScores = np.sort(scores[hasLedge])
+            screenFraction = ledgeScores[int(np.floor(falseNegativeRate*len(ledgeScores)))]
+        else:
+            screenFraction = screenParameters["screenFraction"]
+
+        return {"screenFraction": screenFraction,
+                "ledges": int(np.sum(hasLedge)),
+                "falseNegatives": int(np.sum(hasLedge & (scores < screenFraction))),
+                "skipped": np.mean(scores < screenFraction)}
+
+    def map(self, function, executor = "serial", nWorkers = None, chunkSize = 64, args = (), kwargs = {}):
+        """
+        return the list of function(wf, *args, **kwargs) for each waveform in the collection.
+        executor is "serial", "threads" or "processes", and the waveforms are handed to
+        nWorkers workers (default: one per CPU) chunkSize at a time.
+
+        With processes, the samples are shared with the workers through a memory-mapped file
+        (the dataFile cache if the collection was loaded from one, otherwise a temporary copy),
+        and function must be picklable (defined at the top level of a module).
+        Any changes function makes to the waveforms stay in the worker processes
+        """
+        chunks = [self.positions[start:start + chunkSize]
+                  for start in range(0, self.size, chunkSize)]
+
+        if executor == "serial":
+            return [function(wf, *args, **kwargs) for wf in self]
+        elif executor == "threads":
+            pool = multiprocessing.pool.ThreadPool(nWorkers)
+            jobs = [(function, self.store, positions, args, kwargs) for positions in chunks]
+        elif executor == "processes":
+            sharedDir = None
+            samplesFile = self.store.samplesFile
+            if samplesFile is None:
+                sharedDir = tempfile.mkdtemp(dir = "/dev/shm" if os.path.isdir("/dev/shm") else None)
+                samplesFile = os.path.join(sharedDir, "samples.npy")
+                np.save(samplesFile, self.store.samples)
+            results = {column: getattr(self.store, column)
+                       for column in waveformStore.resultColumns}
+            pool = multiprocessing.Pool(nWorkers,
+                                        initializer = init_broadcast_worker,
+                                        initargs = (self.store.headers, samplesFile, results))
+            jobs = [(function, None, positions, args, kwargs) for positions in chunks]
+        else:
+            raise ValueError("unknown executor " + str(executor))
+
+        try:
+            results = pool.map(broadcast_chunk, jobs)
+        finally:
+            pool.terminate()
+            pool.join()
+            if executor == "processes" and sharedDir:
+                shutil.rmtree(sharedDir)
+
+        return [result for chunk in results for result in chunk]
+
+    def save_plots(self, outDir = "./", ext = "png", ledgesOnly = False,
+                   executor = "processes", nWorkers = None, chunkSize = 64):
+        """
+        save a diagnostic plot of each waveform, like waveform.plot, into a directory tree
+        outDir/chip/channel/ (see plot_file_name), using the ledges already found.
+        If ledgesOnly is True, only the waveforms with a ledge are plotted.
+        The plots are drawn with reused Agg figures (see waveformPlotter) and shared
+        between workers as in map.  Returns the list of file names.
+        Repeated acquisitions of the same chip, channel and pulser magnitude are saved to the same file
+        """
+        collection = self
+        if ledgesOnly:
+            collection = waveformCollection(store = self.store,
+                                            positions = self.positions[self.rows(self.store.hasLedge)])
+        if not collection.size:
+            return []
+
+        # make the directories here, so that the workers do not race to make them
+        for chip, channel in set(zip(collection.column("ID"), collection.column("channel"))):
+            directory = os.path.join(outDir, str(chip), str(channel))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+
+        return collection.map(save_waveform_plot, executor = executor, nWorkers = nWorkers,
+                              chunkSize = chunkSize, args = (outDir, ext))
 
     def broadcast(self, function, iterkeys = None, dtype = np.float64, *args, **kwargs):
         """
-        Do the function to all waveforms in the collection, with the result saved in a numpy array
+        Do the function to all waveforms in the collection, with the result saved in a numpy array.
+        If iterkeys (a list of header keys) is given, the result has one axis per key,
+        indexed like self.uniques[key], with the last waveform of each cell kept if there are
+        several (see grid_cells for the duplicates keyword).
+        The keyword arguments executor, nWorkers and chunkSize are passed on to map
+        instead of to function
         """
+        options = {option: kwargs.pop(option)
+                   for option in ["executor", "nWorkers", "chunkSize"]
+                   if option in kwargs}
+        duplicates = kwargs.pop("duplicates", "last")
+        if not self.size:
+            raise ValueError("No waveforms in collection!")
+
+        results = self.map(function, args = args, kwargs = kwargs, **options)
+
         if iterkeys:
-            shape = tuple(len(self.uniques[key])
-                          for key in iterkeys)
-            result = np.zeros(shape, dtype = dtype)
-            thiskey = iterkeys[0]
-            for i, (colVal, subCollection) in enumerate(self.byHeaderCol(thiskey)):
-                result[i] = broadcast(function,
-                                      subCollection,
-                                      iterkeys[1:],
-                                      *args,
-                                      **kwargs)
+            values = np.array(results, dtype = dtype)
+            shape, cells, kept = self.grid_cells(iterkeys, duplicates)
+            result = np.zeros(shape + values.shape[1:], dtype = dtype)
+            result[cells] = values[kept]
+        elif self.size == 1:
+            result = results[0]
+        else:
+            result = np.array(results)
+
+        return result
 
+    def grid_cells(self, iterkeys, duplicates = "last"):
+        """
+        place the waveforms on a grid with one axis per header key in iterkeys,
+        indexed like self.uniques[key].  Where several waveforms (repeated acquisitions)
+        fall in the same cell, duplicates says which one is kept: "last" or "first" in the
+        order of the collection, or "error" to raise a ValueError naming the cell.
+        Returns the shape of the grid, the tuple of index arrays of the cell of each kept
+        waveform and the (sorted) indices within the collection of the kept waveforms
+        """
+        shape = tuple(len(self.uniques[key])
+                      for key in iterkeys)
+        cells = tuple(np.searchsorted(self.uniques[key], self.column(key))
+                      for key in iterkeys)
+        flat = np.ravel_multi_index(cells, shape)
+        values, first, counts = np.unique(flat, return_index = True, return_counts = True)
+        if duplicates == "first":
+            kept = np.sort(first)
+        elif duplicates == "last":
+            kept = np.sort(self.size - 1 - np.unique(flat[::-1], return_index = True)[1])
+        elif duplicates == "error":
+            if np.any(counts > 1):
+                cell = first[np.argmax(counts > 1)]
+                raise ValueError(str(np.max(counts)) + " waveforms in the cell " +
+                                 ", ".join(key + " = " + str(self.column(key)[cell]) for key in iterkeys) +
+                                 " of " + str(iterkeys) + " (use duplicates = \"first\" or \"last\" to keep one)")
+            kept = np.arange(self.size)
         else:
-            if len(self.waveforms) == 1:
-                result = function(self.waveforms[0], *args, **kwargs)
-            elif len(self.waveforms) > 1:
-                result = np.array([function(wf, *args, **kwargs)
-                                   for wf in self])
-            else:
-                raise ValueError, "No waveforms in collection!"
+            raise ValueError("unknown duplicates " + str(duplicates))
+
+        return shape, tuple(cell[kept] for cell in cells), kept
+
+    def lobe_areas(self, chunkSize = 64):
+        """
+        the areas of the left and right lobes of each waveform's ledge
+        (see waveform.lobe_areas), as two arrays in the order of the collection
+        """
+        leftA = np.zeros(self.size)
+        rightA = np.zeros(self.size)
+        for start in range(0, self.size, chunkSize):
+            positions = self.positions[start:start + chunkSize]
+            leftA[start:start + chunkSize], rightA[start:start + chunkSize] = self.store.stats.lobe_areas(positions)
+
+        return leftA, rightA
 
+    def ledge_areas(self, iterkeys = ["ID", "channel", "ExtPulserMag"], chunkSize = 64, search = True,
+                    duplicates = "last", **parameters):
+        """
+        search every waveform for the ledge effect (see find_ledge) and sum the
+        baseline-subtracted samples over its left lobe (from the start of the ledge to the
+        zero crossing) and its right lobe (from the zero crossing to the end of the ledge).
+        If search is False, the ledges already found are used instead.
+        Returns a dict of arrays leftA, rightA, hasLedge, leftLobe and rightLobe,
+        with one axis per key in iterkeys, as in broadcast (duplicates is passed on to grid_cells)
+        """
+        if search:
+            self.find_ledge(chunkSize = chunkSize, **parameters)
+
+        store = self.store
+        leftA, rightA = self.lobe_areas(chunkSize)
+
+        shape, cells, kept = self.grid_cells(iterkeys, duplicates)
+        result = {}
+        for name, values in [("leftA", leftA),
+                             ("rightA", rightA),
+                             ("hasLedge", self.rows(store.hasLedge)),
+                             ("leftLobe", self.rows(store.leftLobe)),
+                             ("rightLobe", self.rows(store.rightLobe))]:
+            result[name] = np.zeros(shape, dtype = values.dtype)
+            result[name][cells] = values[kept]
         return result
+
+    @profiled("scan_vcrit")
+    def scan_vcrit(self, tolerance = 0.05, coarse = 5, confirm = 3, chunkSize = 64,
+                   executor = "serial", nWorkers = None, duplicates = "last", **parameters):
+        """
+        find Vcrit for every chip and channel like ledge_areas followed by utils.extract_vcrit,
+        but without searching the pulser magnitudes below the ledge onset.  Each channel's
+        magnitudes are visited coarse to fine: first coarse of them spread over the scan, then,
+        by bisection, the one in the middle of the bracket between the lowest magnitude with a
+        ledge and the highest one without a ledge below it, until the bracket is only one step
+        or tolerance (in V) wide.  Then every magnitude above the bottom of the bracket is
+        searched, along with the confirm magnitudes up to it, and the skipped ones below those
+        are taken to have no ledge (and no area).
+        In each round, the waveforms of every channel are searched together, chunkSize at a time.
+
+        This relies on the ledges turning on once and staying on, which the search checks:
+        a channel with no ledge in the first round, with any magnitude without a ledge above
+        one with a ledge (a missed ledge, which can make the bisection bracket the wrong place,
+        e.g. one found by the confirm magnitudes below the bracket), or with fewer than confirm
+        magnitudes from its lowest ledge to the top of the scan, is searched in full.
+        The fit then uses the same points as ledge_areas and extract_vcrit, and so gives the
+        same Vcrit, unless a ledge further below the bracket was skipped.  The Vcrit fit depends
+        on the area of every ledge above the onset, so only the search below the onset is
+        saved, not the fit.
+        Returns the dict of extract_vcrit (with executor and nWorkers passed on), with the number
+        of waveforms searched in each channel (visited) and the bracket (the highest magnitude
+        without a ledge below the lowest one with a ledge, and that one, nan where open).
+        The fitted Vcrit need not fall within the bracket
+        """
+        shape, cells, kept = self.grid_cells(["ID", "channel", "ExtPulserMag"], duplicates)
+        V = np.asarray(self.uniques["ExtPulserMag"], dtype = float)
+        nV = shape[2]
+        # the store row of each channel's waveform at each magnitude, or -1 if there is none
+        grid = np.full(shape, -1, dtype = int)
+        grid[cells] = self.positions[kept]
+        grid = grid.reshape(-1, nV)
+        steps = np.arange(nV)
+
+        available = grid >= 0
+        visited = np.zeros(grid.shape, dtype = bool)
+        ledge = np.zeros(grid.shape, dtype = bool)
+        todo = np.zeros(grid.shape, dtype = bool)
+        todo[:, np.unique(np.round(np.linspace(0, nV - 1, min(coarse, nV))).astype(int))] = True
+        while True:
+            rows, columns = np.nonzero(todo & available & ~visited)
+            if not len(rows):
+                break
+            positions = grid[rows, columns]
+            for start in range(0, len(positions), chunkSize):
+                these = positions[start:start + chunkSize]
+                self.store.record_ledges(these, self.store.stats.find_ledges(these, **parameters))
+            visited[rows, columns] = True
+            ledge[rows, columns] = self.store.hasLedge[positions]
+
+            # the bracket of each channel: the lowest magnitude with a ledge (hi)
+            # and the highest one below it without (lo), or nV and -1 where there are none
+            hi = np.where(np.any(ledge, axis = 1), np.argmax(ledge, axis = 1), nV)
+            below = visited & ~ledge & (steps < hi[:, None])
+            lo = np.where(np.any(below, axis = 1), nV - 1 - np.argmax(below[:, ::-1], axis = 1), -1)
+            with np.errstate(invalid = "ignore"):
+                width = np.where((lo >= 0) & (hi < nV), V[hi.clip(max = nV - 1)] - V[lo.clip(0)], np.inf)
+
+            # channels with a magnitude without a ledge above one with a ledge, or with fewer
+            # than confirm magnitudes from the lowest ledge up to show that it stays on
+            missed = np.any(visited & ~ledge & (steps > hi[:, None]), axis = 1)
+            missed |= np.sum(available & (steps >= hi[:, None]), axis = 1) < confirm
+
+            inside = available & ~visited & (steps > lo[:, None]) & (steps < hi[:, None])
+            bisect = (hi < nV) & ~missed & np.any(inside, axis = 1) & (width > tolerance)
+            middle = np.argmin(np.where(inside, np.abs(steps - (lo + hi)[:, None]/2.), np.inf), axis = 1)
+
+            # channels which are bracketed get every magnitude above the bottom of the bracket,
+            # and the confirm magnitudes up to it
+            todo = available & (steps > lo[:, None] - confirm) & ((hi < nV) & ~bisect)[:, None]
+            todo[np.flatnonzero(bisect), middle[bisect]] = True
+            # channels without a ledge at any magnitude visited so far have no bracket to narrow
+            # down, and ones with a missed ledge can't trust theirs: both are searched in full
+            todo |= available & ((hi == nV) | missed)[:, None]
+
+        bracket = np.stack((np.where(lo >= 0, V[lo.clip(0)], np.nan),
+                            np.where(hi < nV, V[hi.clip(max = nV - 1)], np.nan)), axis = -1)
+
+        # the magnitudes below the bracket which were skipped, taken to have no ledge
+        assumed = available & ~visited & (steps < lo[:, None] - confirm + 1)
+
+        leftA = np.zeros(grid.shape)
+        rightA = np.zeros(grid.shape)
+        rows, columns = np.nonzero(visited)
+        for start in range(0, len(rows), chunkSize):
+            chunk = slice(start, start + chunkSize)
+            leftA[rows[chunk], columns[chunk]], rightA[rows[chunk], columns[chunk]] = \
+                self.store.stats.lobe_areas(grid[rows[chunk], columns[chunk]])
+        flags = [visited & getattr(self.store, name)[grid]
+                 for name in ["hasLedge", "leftLobe", "rightLobe"]]
+        result = utils.extract_vcrit(V, leftA, rightA, *flags, visited = visited | assumed,
+                                     executor = executor, nWorkers = nWorkers)
+
+        result = {name: values.reshape(shape[:2] + values.shape[1:]) for name, values in result.items()}
+        result["visited"] = visited.sum(axis = 1).reshape(shape[:2])
+        result["bracket"] = bracket.reshape(shape[:2] + (2,))
+        return result
+
+    @profiled("fit_pulses")
+    def fit_pulses(self, chunkSize = 1024, ax = None, **parameters):
+        """
+        fit the shaper response (utils.shaper_model) to the pulse of every waveform at once,
+        chunkSize waveforms at a time (see utils.fit_models), using the settings in
+        pulseFitParameters (overridden by keyword).  Each fit starts with the peak at the
+        largest sample, the nominal peaking time from the peakingTime header and the waveform's
+        baseline, and only uses the samples from before to after peaking times around the peak.
+        If ax is given, the fitted pulses are drawn on it.
+        Returns a dict of arrays in the order of the collection: amplitude (ADC counts above the
+        baseline), start, peakingTime (both in ticks) and baseline of each pulse, and the chi2,
+        ndf (number of samples fit minus number of parameters), iterations and success of each fit
+        """
+        p = dict(pulseFitParameters, **parameters)
+        names = ["amplitude", "start", "peakingTime", "baseline"]
+        result = {name: np.full(self.size, np.nan) for name in names + ["chi2"]}
+        result.update({"ndf": np.zeros(self.size, dtype = int),
+                       "iterations": np.zeros(self.size, dtype = int),
+                       "success": np.zeros(self.size, dtype = bool)})
+        if not self.size:
+            return result
+
+        ticks = self.ticks
+        nTicks = len(ticks)
+        if "peakingTime" in self.store.headers.dtype.names:
+            nominal = peaking_ticks(self.column("peakingTime"), p["defaultPeakingTime"])
+        else:
+            nominal = np.full(self.size, p["defaultPeakingTime"])
+        bounds = [(0, None), (None, None), (0.5, None), (None, None)]
+
+        for start in range(0, self.size, chunkSize):
+            rows = slice(start, start + chunkSize)
+            positions = self.positions[rows]
+            samples = np.asarray(self.store.samples[positions], dtype = float)
+            baselines = self.store.baseline[positions]
+            peakingTime = nominal[rows]
+            peaks = np.argmax(samples, axis = 1)
+
+            # the samples of every fit window, over the range of ticks covering all of them
+            first = np.clip(np.floor(peaks - p["before"]*peakingTime), 0, nTicks - 1).astype(int)
+            last = np.clip(np.ceil(peaks + p["after"]*peakingTime), 0, nTicks - 1).astype(int)
+            span = slice(first.min(), last.max() + 1)
+            window = ((ticks[span] >= first[:, None]) & (ticks[span] <= last[:, None])).astype(float)
+
+            guess = np.column_stack((samples[np.arange(len(peaks)), peaks] - baselines,
+                                     ticks[peaks] - peakingTime,
+                                     peakingTime,
+                                     baselines))
+            params, cost, iterations, success = utils.fit_models(ticks[span], samples[:, span],
+                                                                 utils.shaper_model, guess,
+                                                                 bounds = bounds, weights = window)
+            for i, name in enumerate(names):
+                result[name][rows] = params[:, i]
+            result["chi2"][rows] = cost
+            result["ndf"][rows] = window.sum(axis = 1).astype(int) - len(names)
+            result["iterations"][rows] = iterations
+            result["success"][rows] = success
+
+        if ax is not None:
+            for args in zip(*[result[name] for name in names]):
+                ax.plot(ticks, utils.shaper_model(ticks, *args))
+
+        return result
+
+class waveformQuery(object):
+    """
+    a lazy query over a waveformCollection (see waveformCollection.query).  filter, group_by,
+    map and aggregate only record what is to be done, returning a new query, and nothing is
+    computed until execute.  Then all of the filters are applied at once (index lookups first,
+    the most selective first, then any functions of a column), the waveforms left are grouped
+    in one pass, the map runs over all of them together and each group is aggregated
+    """
+    aggregates = ["count", "sum", "mean", "min", "max"]
+
+    def __init__(self, source, filters = (), groupKeys = (), mapping = None, aggregation = None):
+        self.source = source
+        self.filters = tuple(filters)
+        self.groupKeys = tuple(groupKeys)
+        self.mapping = mapping
+        self.aggregation = aggregation
+
+    def replace(self, **changes):
+        "a copy of this query with some of its steps changed"
+        steps = {"filters": self.filters,
+                 "groupKeys": self.groupKeys,
+                 "mapping": self.mapping,
+                 "aggregation": self.aggregation}
+        steps.update(changes)
+        return waveformQuery(self.source, **steps)
+
+    def filter(self, selection = None, **fields):
+        """
+        keep the waveforms whose headers match every key: value pair of the selection dict
+        and the keywords.  A value can be a single value, a list (tuple, set or array)
+        of allowed values, or a function of the header column returning a boolean mask
+        """
+        if self.mapping or self.aggregation:
+            raise ValueError("filter must come before map and aggregate")
+        fields = dict(selection or {}, **fields)
+        return self.replace(filters = self.filters + tuple(fields.items()))
+
+    def group_by(self, *keys):
+        "group the waveforms by the values of one or more header keys"
+        if self.aggregation:
+            raise ValueError("group_by must come before aggregate")
+        return self.replace(groupKeys = self.groupKeys + keys)
+
+    def map(self, function, executor = "serial", nWorkers = None, chunkSize = 64, args = (), kwargs = {}):
+        "apply function to each waveform (see waveformCollection.map for the options)"
+        if self.mapping or self.aggregation:
+            raise ValueError("a query can only have one map, before aggregate")
+        return self.replace(mapping = (function, {"executor": executor,
+                                                  "nWorkers": nWorkers,
+                                                  "chunkSize": chunkSize,
+                                                  "args": args,
+                                                  "kwargs": kwargs}))
+
+    def aggregate(self, function):
+        """
+        reduce each group (or the whole selection, without group_by) to one result.
+        function is given the list of mapped values of the group, or its waveformCollection
+        if there is no map.  It can also be one of the names in aggregates, which are worked
+        out for every group at once ("count" also works without a map)
+        """
+        if self.aggregation:
+            raise ValueError("a query can only have one aggregate")
+        if not callable(function):
+            if not function in self.aggregates:
+                raise ValueError("unknown aggregate " + str(function))
+            if function != "count" and not self.mapping:
+                raise ValueError("aggregate " + function + " needs a map first")
+        return self.replace(aggregation = function)
+
+    def positions(self):
+        "the positions in the store of the waveforms which pass every filter, in the order of the collection"
+        source = self.source
+        store = source.store
+        lookups = []
+        predicates = []
+        for key, value in self.filters:
+            if callable(value):
+                predicates.append((key, value))
+            elif isinstance(value, (list, tuple, set, np.ndarray)):
+                lookups.append(np.unique(np.concatenate([store.lookup(key, v) for v in value] +
+                                                        [np.array([], dtype = int)])))
+            else:
+                lookups.append(store.lookup(key, value))
+
+        lookups.sort(key = len)
+        if source.whole and lookups:
+            positions = lookups.pop(0)
+        else:
+            positions = source.positions
+        for rows in lookups:
+            positions = positions[in_sorted(positions, rows)]
+        for key, predicate in predicates:
+            positions = positions[np.asarray(predicate(store.headers[key][positions]), dtype = bool)]
+
+        return positions
+
+    def uniques(self, key):
+        "the sorted unique values of a header field among the waveforms the query selects"
+        values, codes, rows = self.source.store.inverted_index(key)
+        return values[np.unique(codes[self.positions()])]
+
+    def execute(self):
+        """
+        run the query.  Without group_by, the result is the waveformCollection selected,
+        the list of mapped values or the aggregate.  With group_by, it is an OrderedDict of
+        these for each group, keyed by the group's value (or tuple of values, for several keys)
+        and ordered like uniques
+        """
+        store = self.source.store
+        positions = self.positions()
+
+        if self.groupKeys:
+            indexes = [store.inverted_index(key) for key in self.groupKeys]
+            shape = tuple(len(values) for values, codes, rows in indexes)
+            combined = np.ravel_multi_index([codes[positions] for values, codes, rows in indexes], shape)
+            groupCodes, inverse = np.unique(combined, return_inverse = True)
+            names = []
+            for cell in zip(*np.unravel_index(groupCodes, shape)):
+                name = tuple(values[i] for (values, codes, rows), i in zip(indexes, cell))
+                names.append(name[0] if len(name) == 1 else name)
+        else:
+            inverse = np.zeros(len(positions), dtype = int)
+            names = [None]
+
+        order = np.argsort(inverse, kind = "mergesort")
+        counts = np.bincount(inverse, minlength = len(names))
+        starts = np.cumsum(counts) - counts
+        groups = np.split(order, starts[1:])
+
+        mapped = None
+        if self.mapping:
+            function, options = self.mapping
+            mapped = waveformCollection(store = store, positions = positions).map(function, **options)
+
+        if self.aggregation in self.aggregates:
+            results = self.named_aggregate(mapped, order, counts, starts)
+        else:
+            results = []
+            for group in groups:
+                if mapped is None:
+                    result = waveformCollection(store = store, positions = positions[group])
+                else:
+                    result = [mapped[i] for i in group]
+                if self.aggregation:
+                    result = self.aggregation(result)
+                results.append(result)
+
+        if not self.groupKeys:
+            return results[0]
+        return OrderedDict(zip(names, results))
+
+    def named_aggregate(self, mapped, order, counts, starts):
+        "one of the aggregates, for every group at once from the mapped values sorted by group"
+        if self.aggregation == "count":
+            return list(counts)
+
+        values = np.asarray(mapped, dtype = float)
+        if not len(values):
+            return [np.nan]*len(counts)
+        values = values[order]
+        if self.aggregation in ("sum", "mean"):
+            totals = np.add.reduceat(values, starts, axis = 0)
+            if self.aggregation == "sum":
+                return list(totals)
+            return list(totals/counts.reshape((-1,) + (1,)*(values.ndim - 1)))
+        elif self.aggregation == "min":
+            return list(np.minimum.reduceat(values, starts, axis = 0))
+        else:
+            return list(np.maximum.reduceat(values, starts, axis = 0))
+
+# the store of a process started by waveformCollection.map
+workerStore = None
+
+def init_broadcast_worker(headers, samplesFile, results):
+    "set up a worker process of waveformCollection.map with a store sharing the parent's samples"
+    global workerStore
+    workerStore = waveformStore(headers, np.load(samplesFile, mmap_mode = "r"), samplesFile)
+    for column, values in results.items():
+        setattr(workerStore, column, values)
+
+def broadcast_chunk(job):
+    "apply a function to a chunk of waveforms in a worker of waveformCollection.map"
+    function, store, positions, args, kwargs = job
+    if store is None:
+        store = workerStore
+    return [function(waveform.view(store, index), *args, **kwargs)
+            for index in positions]
@@ -1,3 +1,13 @@
+import io
+import os
+import json
+import warnings
+import zipfile
+import itertools
+import multiprocessing
+import multiprocessing.pool
+from collections import OrderedDict
+
 from coldAna import *
 from utils import *
 
@@ -32,50 +42,568 @@ lookup = {"testPulseValue":      {0: False,
                                   1: 100},
 }
 
+# the bit layout of the configuration bytes of each chip version (see the README):
+# for each byte, (header field, lookup table, first bit counted from the left as in hex_to_bin, number of bits)
+configLayouts = {"v7": {"conf": [("testPulse", "testPulseValue", 0, 1),
+                                 ("baseline", "baselineValue", 1, 1),
+                                 ("gain", "gainValue", 2, 2),
+                                 ("peakingTime", "peakingTimeValue", 4, 2),
+                                 ("outputCoupling", "outputCouplingValue", 6, 1),
+                                 ("outputBuffer", "outputBufferValue", 7, 1)],
+                        "globalConf": [("SDC", "SDCValue", 2, 1),
+                                       ("SLKH", "SLKHValue", 3, 1),
+                                       ("Ch16Filter", "Ch16FilterValue", 4, 1),
+                                       ("Channel0", "Channel0Value", 5, 1),
+                                       ("STB1", "STB1Value", 6, 1),
+                                       ("Leakage", "LeakageValue", 7, 1)]}}
+
+# chip versions without a layout of their own are decoded with this one
+defaultLayout = "v7"
+
+# (layout, byte name): the decoded fields of all 256 values of the byte, filled in by decode_table
+decodeTables = {}
+
+def decode(tableName, codes):
+    "look up an array of integer codes in one of the lookup tables"
+    table = lookup[tableName]
+    return np.array([table[code] for code in range(len(table))])[codes]
+
+def decode_table(chipType, byteName):
+    """
+    a dict of header field: array of the field's decoded value for each of the 256 possible
+    values of a configuration byte, in the layout of chipType.  Each table is only made once
+    """
+    layout = chipType if chipType in configLayouts else defaultLayout
+    if not (layout, byteName) in decodeTables:
+        codes = np.arange(256)
+        table = OrderedDict()
+        for field, tableName, place, width in configLayouts[layout][byteName]:
+            table[field] = decode(tableName, (codes >> (8 - place - width)) & (2**width - 1))
+        decodeTables[(layout, byteName)] = table
+
+    return decodeTables[(layout, byteName)]
+
+def decode_config(column, chipTypes, byteName):
+    """
+    decode a column of configuration bytes (hex strings) into a dict of header field: array,
+    by indexing the decode_table of each row's chip version with the value of the byte
+    """
+    codes = hex_to_int(column)
+    types, typeCodes = np.unique(chipTypes, return_inverse = True)
+    if len(types) <= 1:
+        table = decode_table(types[0] if len(types) else defaultLayout, byteName)
+        return {field: values[codes] for field, values in table.items()}
+
+    result = {}
+    for i, chipType in enumerate(types):
+        rows = typeCodes == i
+        for field, values in decode_table(chipType, byteName).items():
+            if not field in result:
+                result[field] = np.empty(len(codes), dtype = values.dtype)
+            result[field][rows] = values[codes[rows]]
+
+    return result
+
+@profiled("load.decode_headers")
+def decode_headers(headerFields, headerSize = 13):
+    """
+    decode the raw header fields (one list of strings per line)
+    into a structured array with one record per line and fields in the order of headerKeys
+    """
+    raw = np.array(headerFields, dtype = str).reshape(-1, headerSize)
+
+    columns = {"ID": raw[:, 0],
+               "chipType": raw[:, 1],
+               "socket": raw[:, 2].astype(int),
+               "channel": raw[:, 3].astype(int),
+               "conf": raw[:, 4],
+               "otherConf": raw[:, 5],
+               "globalConf": raw[:, 6],
+               "DACconf": raw[:, 7],
+               "DACnum": raw[:, 8],
+               "ExtPulserMag": raw[:, 9].astype(float),
+               "ExtPulserRise": raw[:, 10],
+               "temp": raw[:, 11],
+               "N": raw[:, 12].astype(int)}
+    columns.update(decode_config(raw[:, 4], raw[:, 1], "conf"))
+    columns.update(decode_config(raw[:, 6], raw[:, 1], "globalConf"))
+    columns["leakageCurrent"] = columns["SLKH"]*columns["Leakage"]
+
+    return header_table(columns)
+
+def selection_mask(headers, selection):
+    """
+    boolean array of the records of a header table which match
+    every key: value pair of the selection dict
+    """
+    mask = np.ones(len(headers), dtype = bool)
+    for key, value in selection.items():
+        mask &= headers[key] == value
+
+    return mask
+
+def compact_samples(samples):
+    """
+    return the samples as int16 if that is lossless (ADC counts are 14-bit integers),
+    otherwise as float32 if that is lossless, otherwise unchanged
+    """
+    for dtype in (np.int16, np.float32):
+        compact = samples.astype(dtype)
+        if np.array_equal(compact, samples):
+            return compact
+
+    return samples
+
 class dataFile:
-    def __init__(self, fileName, headerSize = 13):
+    cacheVersion = 1
+
+    def __init__(self, fileName, headerSize = 13, cache = False, cacheDir = None):
+        """
+        fileName is the plaintext DAQ file.  If cache is True, the parsed
+        headers and samples are kept in a binary sidecar directory
+        (fileName + ".cache", or inside cacheDir if given) which is
+        memory-mapped on later loads instead of re-parsing the text
+        """
         self.fileName = fileName
         self.headerSize = headerSize
+        self.cache = cache
+        if cacheDir:
+            self.cacheDir = os.path.join(cacheDir, os.path.basename(fileName) + ".cache")
+        else:
+            self.cacheDir = fileName + ".cache"
+
+    @profiled("load.split_lines")
+    def split_lines(self, lines, keepPayloads = True):
+        """
+        split each line into its header fields and its (still unparsed) sample payload,
+        skipping blank and commented lines.  If keepPayloads is False, the payloads are
+        dropped as soon as each line is split and an empty list is returned for them
+        """
+        headerFields = []
+        payloads = []
+        for line in lines:
+            fields = line.split(None, self.headerSize)
+            if len(fields) <= self.headerSize or fields[0].startswith("#"):
+                continue
+            headerFields.append(fields[:self.headerSize])
+            if keepPayloads:
+                payloads.append(fields[self.headerSize])
+
+        return headerFields, payloads
+
+    @profiled("load.parse_samples")
+    def parse_samples(self, payloads, nSamples):
+        "parse the sample payloads into a (line, tick) array, keeping the first nSamples of each line"
+        samples = np.empty((len(payloads), nSamples))
+        for i, payload in enumerate(payloads):
+            samples[i] = np.fromstring(payload, sep = " ", count = nSamples)
+
+        return samples
+
+    def parse(self, lines, selection = None, blockSize = 4096):
+        """
+        parse an iterable of lines in a single pass,
+        returning the decoded header table and the array of samples.
+        If a selection dict is given, the lines are split and their headers decoded
+        blockSize lines at a time, and only the payloads of the lines whose headers match
+        are kept, so the text and samples of the other lines are never held all at once
+        """
+        if not selection:
+            headerFields, payloads = self.split_lines(lines)
+            headers = decode_headers(headerFields, self.headerSize)
+            nSamples = headers['N'][0] if len(headers) else 0
+            return headers, self.parse_samples(payloads, nSamples)
+
+        lines = iter(lines)
+        blocks = []
+        payloads = []
+        nSamples = None
+        while True:
+            block = list(itertools.islice(lines, blockSize))
+            if not block:
+                break
+            headerFields, blockPayloads = self.split_lines(block)
+            del block
+            if not headerFields:
+                continue
+            headers = decode_headers(headerFields, self.headerSize)
+            if nSamples is None:
+                nSamples = headers['N'][0]
+            mask = selection_mask(headers, selection)
+            blocks.append(headers[mask])
+            payloads += [payload for payload, keep in zip(blockPayloads, mask) if keep]
+
+        if not blocks:
+            return decode_headers([], self.headerSize), self.parse_samples([], 0)
+        names = blocks[0].dtype.names
+        headers = header_table({name: np.concatenate([block[name] for block in blocks])
+                                for name in names},
+                               names)
+        return headers, self.parse_samples(payloads, nSamples)
+
+    def source_signature(self):
+        "the size and modification time of the plaintext file, used to validate the cache"
+        stat = os.stat(self.fileName)
+        return {"version": self.cacheVersion,
+                "headerSize": self.headerSize,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime}
+
+    def samples_file(self):
+        "the .npy file of the cached samples"
+        return os.path.join(self.cacheDir, "samples.npy")
+
+    @profiled("load.read_cache")
+    def read_cache(self):
+        """
+        return the cached header table and memory-mapped samples,
+        or None if there is no cache or it is out of date
+        """
+        try:
+            with open(os.path.join(self.cacheDir, "source.json")) as f:
+                signature = json.load(f)
+            if signature != self.source_signature():
+                return None
+            headers = np.load(os.path.join(self.cacheDir, "headers.npy"))
+            samples = np.load(self.samples_file(), mmap_mode = "r")
+        except (IOError, OSError, ValueError):
+            return None
+
+        return headers, samples
+
+    @profiled("load.write_cache")
+    def write_cache(self, headers, samples, signature):
+        """
+        write the header table and a compact copy of the samples to the cache directory,
+        with the source signature the file had before it was parsed (so that if the file
+        grew while it was being read, the cache is out of date instead of missing lines).
+        The signature is written last, so an interrupted write leaves an invalid cache
+        """
+        signatureFile = os.path.join(self.cacheDir, "source.json")
+        try:
+            if not os.path.isdir(self.cacheDir):
+                os.makedirs(self.cacheDir)
+            if os.path.exists(signatureFile):
+                os.remove(signatureFile)
+            np.save(os.path.join(self.cacheDir, "headers.npy"), headers)
+            np.save(self.samples_file(), compact_samples(samples))
+            with open(signatureFile, "w") as f:
+                json.dump(signature, f)
+        except (IOError, OSError) as e:
+            warnings.warn("could not write cache for " + self.fileName + ": " + str(e))
+
+    def read(self, selection = None):
+        """
+        returns the decoded header table and the samples of the file,
+        from the cache if it is enabled and up to date.
+        If a selection dict is given, only the lines whose headers match it are returned
+        (see parse).  Writing a missing cache still needs every line to be parsed
+        """
+        if not self.cache:
+            with open(self.fileName) as f:
+                return self.parse(f, selection)
+
+        cached = self.read_cache()
+        if not cached:
+            signature = self.source_signature()
+            with open(self.fileName) as f:
+                parsed = self.parse(f)
+            self.write_cache(parsed[0], parsed[1], signature)
+            cached = self.read_cache() or parsed
+
+        headers, samples = cached
+        if selection:
+            mask = selection_mask(headers, selection)
+            return headers[mask], np.asarray(samples[mask])
+        return headers, samples
+
+    @profiled("scan_headers")
+    def scan_headers(self):
+        """
+        returns the decoded header table of the file, without parsing any samples,
+        and a dict of the sorted unique values of each header field
+        """
+        cached = self.cache and self.read_cache()
+        if cached:
+            headers = cached[0]
+        else:
+            with open(self.fileName) as f:
+                headerFields = self.split_lines(f, keepPayloads = False)[0]
+            headers = decode_headers(headerFields, self.headerSize)
+
+        return headers, {key: np.unique(headers[key]) for key in headers.dtype.names}
 
-    def load(self):
-        "returns a waveformCollection object from a file"
-        headerStrings = np.loadtxt(self.fileName,
-                                   usecols = range(self.headerSize),
-                                   dtype = str)
-        
-        headers = [{"ID": headerString[0],
-                    "chipType": headerString[1],
-                    "socket": int(headerString[2]),
-                    "channel": int(headerString[3]),
-                    "conf": headerString[4],
-                    "testPulse": lookup["testPulseValue"][hex_to_bin(headerString[4])[0]],
-                    "baseline": lookup["baselineValue"][hex_to_bin(headerString[4])[1]],
-                    "gain": lookup["gainValue"][(int(headerString[4], 16) & 48) >> 4],
-                    "peakingTime": lookup["peakingTimeValue"][(int(headerString[4], 16) & 12) >> 2],
-                    "outputCoupling": lookup["outputCouplingValue"][hex_to_bin(headerString[4])[6]],
-                    "outputBuffer": lookup["outputBufferValue"][hex_to_bin(headerString[4])[7]],
-                    "otherConf": headerString[5],
-                    "globalConf": headerString[6],
-                    "SDC": lookup["SDCValue"][hex_to_bin(headerString[6])[2]],
-                    "SLKH": lookup["SLKHValue"][hex_to_bin(headerString[6])[3]],
-                    "Ch16Filter": lookup["Ch16FilterValue"][hex_to_bin(headerString[6])[3]],
-                    "Channel0": lookup["Channel0Value"][hex_to_bin(headerString[6])[5]],
-                    "STB1": lookup["STB1Value"][hex_to_bin(headerString[6])[6]],
-                    "Leakage": lookup["LeakageValue"][hex_to_bin(headerString[6])[7]],
-                    "leakageCurrent": lookup["SLKHValue"][hex_to_bin(headerString[6])[3]] * lookup["LeakageValue"][hex_to_bin(headerString[6])[7]],
-                    "DACconf": headerString[7],
-                    "DACnum": headerString[8],
-                    "ExtPulserMag": float(headerString[9]),
-                    "ExtPulserRise": headerString[10],
-                    "temp": headerString[11],
-                    "N": int(headerString[12])}
-                   for headerString in headerStrings]
-    
-        data = np.loadtxt(self.fileName,
-                          usecols = range(self.headerSize, self.headerSize + headers[0]['N']))
-        
-        return waveformCollection([waveform(thisHeader, dat) for thisHeader, dat in zip(headers, data)])
+    @profiled("load")
+    def load(self, selection = None):
+        """
+        returns a waveformCollection object from a file.
+        If a selection dict of header key: value pairs is given, only the matching
+        waveforms are loaded, like waveformCollection[selection] but without
+        parsing the samples of the others
+        """
+        headers, samples = self.read(selection)
+        if isinstance(samples, np.memmap):
+            samplesFile = self.samples_file()
+        else:
+            samplesFile = None
 
+        return waveformCollection(store = waveformStore(headers, samples, samplesFile))
+
+    def iter_read(self, chunkSize = 1024, selection = None):
+        """
+        yields the decoded header table and the samples of up to chunkSize lines
+        of the file at a time, so that only one chunk is in memory at once.
+        If the cache is enabled and up to date, the chunks are slices of it
+        (a missing cache is not written, since that would need the whole file).
+        If a selection dict is given, only the matching lines of each chunk are kept
+        """
+        if self.cache:
+            cached = self.read_cache()
+            if cached:
+                headers, samples = cached
+                for start in range(0, len(headers), chunkSize):
+                    chunkHeaders = headers[start:start + chunkSize]
+                    chunkSamples = samples[start:start + chunkSize]
+                    if selection:
+                        mask = selection_mask(chunkHeaders, selection)
+                        chunkHeaders, chunkSamples = chunkHeaders[mask], np.asarray(chunkSamples[mask])
+                    if len(chunkHeaders):
+                        yield chunkHeaders, chunkSamples
+                return
+
+        with open(self.fileName) as f:
+            while True:
+                lines = list(itertools.islice(f, chunkSize))
+                if not lines:
+                    break
+                headers, samples = self.parse(lines, selection)
+                if len(headers):
+                    yield headers, samples
+
+    def iter_chunks(self, chunkSize = 1024, selection = None):
+        """
+        yields a waveformCollection for each chunk of up to chunkSize lines of the file
+        (only the ones matching the selection dict, if one is given)
+        """
+        for headers, samples in self.iter_read(chunkSize, selection):
+            yield waveformCollection(store = waveformStore(headers, samples))
+
+    def iter_groups(self, key, chunkSize = 1024, selection = None):
+        """
+        yields (value, waveformCollection) pairs for each run of consecutive lines of the
+        file with the same value of the header key, reading chunkSize lines at a time,
+        so that only about one group is in memory at once.  The files are written one
+        chip (and one channel) at a time, so grouping by ID gives one group per chip,
+        but a value which comes back later in the file gives another group.
+        Lines which don't match the selection dict, if one is given, are skipped
+        """
+        pending = []
+
+        def group():
+            names = pending[0][0].dtype.names
+            groupHeaders = header_table({name: np.concatenate([piece[0][name] for piece in pending])
+                                         for name in names},
+                                        names)
+            groupSamples = np.concatenate([piece[1] for piece in pending])
+            return groupHeaders[key][0], waveformCollection(store = waveformStore(groupHeaders, groupSamples))
+
+        for headers, samples in self.iter_read(chunkSize, selection):
+            values = headers[key]
+            bounds = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1, [len(values)]))
+            for start, stop in zip(bounds[:-1], bounds[1:]):
+                if pending and pending[0][0][key][0] != values[start]:
+                    yield group()
+                    del pending[:]
+                pending.append((headers[start:stop], samples[start:stop]))
+
+        if pending:
+            yield group()
+
+
+def read_catalog_file(job):
+    """
+    read one file of a runCatalog in a worker: returns the header table and the samples,
+    or the name of the cached samples file instead if they are memory-mapped from it
+    """
+    thisFile, selection = job
+    headers, samples = thisFile.read(selection)
+    if isinstance(samples, np.memmap):
+        return headers, thisFile.samples_file()
+    return headers, samples
+
+class runCatalog(object):
+    """
+    the data files of a run, each with a dict of its coordinates within the run
+    (batch, baselineSetting, leakageSetting, ...), which can be loaded together
+    into a single waveformCollection with the coordinates as extra header fields
+    """
+    def __init__(self, entries):
+        "entries is a list of (dataFile, coordinates) pairs"
+        self.entries = list(entries)
+        self.coordinateKeys = []
+        for thisFile, coordinates in self.entries:
+            for key in sorted(coordinates):
+                if not key in self.coordinateKeys:
+                    self.coordinateKeys.append(key)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, i):
+        "the i-th dataFile of the run"
+        return self.entries[i][0]
+
+    def __iter__(self):
+        "iterate through (dataFile, coordinates) pairs"
+        return iter(self.entries)
+
+    def select(self, **coordinates):
+        "the catalog of the files whose coordinates match all of the given ones"
+        return runCatalog([(thisFile, theseCoordinates)
+                           for thisFile, theseCoordinates in self.entries
+                           if all(theseCoordinates.get(key) == value
+                                  for key, value in coordinates.items())])
+
+    @profiled("load_catalog")
+    def load(self, selection = None, executor = "processes", nWorkers = None, **coordinates):
+        """
+        load the files of the run (only the ones matching the given coordinates, if any)
+        and merge them into one waveformCollection, with each file's coordinates
+        added to the headers of its waveforms.  selection is passed on to dataFile.load.
+        The files are read and parsed concurrently: executor is "serial", "threads"
+        or "processes", with nWorkers workers (default: one per CPU).
+        The samples of all of the files are copied into one array in memory, including the
+        ones memory-mapped from a cache; only a single file keeps its memory-mapped samples
+        """
+        catalog = self.select(**coordinates)
+        if not len(catalog):
+            raise ValueError("No files in catalog match " + str(coordinates))
+
+        jobs = [(thisFile, selection) for thisFile, theseCoordinates in catalog]
+        if executor == "serial":
+            pieces = [read_catalog_file(job) for job in jobs]
+        elif executor in ("threads", "processes"):
+            if executor == "threads":
+                pool = multiprocessing.pool.ThreadPool(nWorkers)
+            else:
+                pool = multiprocessing.Pool(nWorkers)
+            try:
+                pieces = pool.map(read_catalog_file, jobs, 1)
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            raise ValueError("unknown executor " + str(executor))
+
+        # files without any (matching) waveforms, e.g. one the DAQ has just created,
+        # have no number of samples to join the others with
+        keep = [i for i, (headers, samples) in enumerate(pieces) if len(headers)] or [0]
+        pieces = [pieces[i] for i in keep]
+        entries = [catalog.entries[i] for i in keep]
+
+        names = [name for name in pieces[0][0].dtype.names
+                 if not name in self.coordinateKeys]
+        columns = {name: np.concatenate([headers[name] for headers, samples in pieces])
+                   for name in names}
+        for key in self.coordinateKeys:
+            columns[key] = np.concatenate([np.repeat(theseCoordinates.get(key), len(headers))
+                                           for (headers, samples), (thisFile, theseCoordinates)
+                                           in zip(pieces, entries)])
+        samplesFile = None
+        if len(pieces) == 1 and isinstance(pieces[0][1], str):
+            samplesFile = pieces[0][1]
+            samples = np.load(samplesFile, mmap_mode = "r")
+        else:
+            samples = np.concatenate([np.load(samples, mmap_mode = "r") if isinstance(samples, str) else samples
+                                      for headers, samples in pieces])
+
+        return waveformCollection(store = waveformStore(header_table(columns, names + self.coordinateKeys),
+                                                        samples, samplesFile))
+
+class collectionFile(object):
+    """
+    a waveformCollection saved in a compressed NumPy (.npz) container: the header table and
+    the analysis results as typed arrays, and the samples in separately compressed chunks of
+    chunkSize waveforms (int16 where that is lossless, see compact_samples).  Each member is
+    only read when it is needed, so loading a selection only decompresses the chunks holding it
+    """
+    formatVersion = 1
+
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    @profiled("write_collection")
+    def write(self, collection, chunkSize = 1024):
+        """
+        save a waveformCollection, with its analysis results, compressing chunkSize waveforms at a time.
+        The container is written next to fileName and moved there when it is complete
+        """
+        store = collection.store
+        nSamples = store.samples.shape[1]
+        partFile = self.fileName + ".part"
+
+        def add(container, name, array):
+            buffer = io.BytesIO()
+            np.lib.format.write_array(buffer, np.asarray(array))
+            container.writestr(name + ".npy", buffer.getvalue())
+
+        container = zipfile.ZipFile(partFile, "w", zipfile.ZIP_DEFLATED, allowZip64 = True)
+        try:
+            add(container, "format", [self.formatVersion, chunkSize, collection.size, nSamples])
+            add(container, "headers", collection.headers)
+            for column in waveformStore.resultColumns:
+                add(container, column, collection.rows(getattr(store, column)))
+            for chunk, start in enumerate(range(0, collection.size, chunkSize)):
+                add(container, "samples%06d" % chunk,
+                    compact_samples(np.asarray(store.samples[collection.positions[start:start + chunkSize]])))
+        finally:
+            container.close()
+        os.rename(partFile, self.fileName)
+
+    def read_format(self, container):
+        "the format version, chunk size, number of waveforms and number of samples of an open container"
+        version, chunkSize, size, nSamples = container["format"]
+        if version > self.formatVersion:
+            raise ValueError(self.fileName + " was written by a newer version (" + str(version) + ")")
+        return chunkSize, size, nSamples
+
+    @profiled("load_collection")
+    def load(self, selection = None):
+        """
+        returns the saved waveformCollection, with its analysis results.
+        If a selection dict of header key: value pairs is given, only the matching
+        waveforms are loaded, and the chunks without any of them are never decompressed
+        """
+        with np.load(self.fileName) as container:
+            chunkSize, size, nSamples = self.read_format(container)
+            headers = container["headers"]
+            if selection:
+                rows = np.flatnonzero(selection_mask(headers, selection))
+            else:
+                rows = np.arange(size)
+
+            chunks = rows//chunkSize
+            pieces = [container["samples%06d" % chunk][rows[chunks == chunk] - chunk*chunkSize]
+                      for chunk in np.unique(chunks)]
+            samples = np.concatenate(pieces) if pieces else np.empty((0, nSamples))
+
+            store = waveformStore(headers[rows], samples)
+            for column in waveformStore.resultColumns:
+                setattr(store, column, container[column][rows])
+
+        return waveformCollection(store = store)
+
+    @profiled("scan_headers")
+    def scan_headers(self):
+        """
+        returns the header table of the saved collection, without reading any samples,
+        and a dict of the sorted unique values of each header field (like dataFile.scan_headers)
+        """
+        with np.load(self.fileName) as container:
+            self.read_format(container)
+            headers = container["headers"]
+
+        return headers, {key: np.unique(headers[key]) for key in headers.dtype.names}
 
 # this is set up for my machine specifically
 # you will probably have to adjust the dataDir
@@ -83,30 +611,39 @@ class dataFile:
 
 dataDir = "../"
 
-V7_run1 = [dataFile(dataDir + "run1/2019-07-31-batch0.dat"),
-           dataFile(dataDir + "run1/2019-08-27-batch1.dat"),
-           dataFile(dataDir + "run1/2019-08-27-batch2.dat"),
-           dataFile(dataDir + "run1/2019-08-27-batch3.dat"),
-           dataFile(dataDir + "run1/2019-08-28-batch4.dat"),
-           dataFile(dataDir + "run1/2019-08-28-batch5.dat"),
-           dataFile(dataDir + "run1/2019-08-28-batch6.dat"),
-           dataFile(dataDir + "run1/2019-08-28-batch7.dat"),
-           dataFile(dataDir + "run1/2019-08-28-batch8.dat")]
-
-V7_run2 = {baseLine: {leakage: [dataFile(dataDir + "run2/batch"
-                                         + str(batchNo) + "/batch"
-                                         + str(batchNo) + "_"
-                                         + str(baseLine) + "mV_"
-                                         + str(leakage) + "pA.dat")
-                                for batchNo in range(1, 7)]
-                      for leakage in [100, 500, 1000, 5000]}
-           for baseLine in [200, 900]}
-
-V7_run4 = {baseline: {leakage: [dataFile(dataDir + "run4/batch"
-                                         + str(batchNo) + "/batch"
-                                         + str(batchNo) + "_"
-                                         + str(baseLine) + "mV_"
-                                         + str(leakage) + "pA.dat")
-                                for batchNo in range(1, 5)]
-                      for leakage in [100, 500, 1000, 5000]}
-           for baseLine in [200, 900]}
+V7_run1 = runCatalog([(dataFile(dataDir + "run1/" + fileName), {"batch": batchNo})
+                      for batchNo, fileName in enumerate(["2019-07-31-batch0.dat",
+                                                          "2019-08-27-batch1.dat",
+                                                          "2019-08-27-batch2.dat",
+                                                          "2019-08-27-batch3.dat",
+                                                          "2019-08-28-batch4.dat",
+                                                          "2019-08-28-batch5.dat",
+                                                          "2019-08-28-batch6.dat",
+                                                          "2019-08-28-batch7.dat",
+                                                          "2019-08-28-batch8.dat"])])
+
+# runs 2 and 4 used to be nested dicts of lists of files, V7_run2[baseline][leakage][i];
+# that file is now V7_run2.select(baselineSetting = baseline, leakageSetting = leakage)[i]
+V7_run2 = runCatalog([(dataFile(dataDir + "run2/batch"
+                                + str(batchNo) + "/batch"
+                                + str(batchNo) + "_"
+                                + str(baseLine) + "mV_"
+                                + str(leakage) + "pA.dat"),
+                       {"batch": batchNo,
+                        "baselineSetting": baseLine,
+                        "leakageSetting": leakage})
+                      for baseLine in [200, 900]
+                      for leakage in [100, 500, 1000, 5000]
+                      for batchNo in range(1, 7)])
+
+V7_run4 = runCatalog([(dataFile(dataDir + "run4/batch"
+                                + str(batchNo) + "/batch"
+                                + str(batchNo) + "_"
+                                + str(baseLine) + "mV_"
+                                + str(leakage) + "pA.dat"),
+                       {"batch": batchNo,
+                        "baselineSetting": baseLine,
+                        "leakageSetting": leakage})
+                      for baseLine in [200, 900]
+                      for leakage in [100, 500, 1000, 5000]
+                      for batchNo in range(1, 5)])
@@ -6,6 +6,7 @@ import scipy.stats as st
 from coldAna import *
 from coldData import V7_run1
 from utils import *
+from thresholds import thresholdTable
 
 mpl.rc('font', family = 'FreeSerif', size = 16, weight = 'bold')
 mpl.rc('text', usetex = True)
@@ -20,106 +21,55 @@ plotRegressions = False
 # plotWaveforms = True
 # plotRegressions = True
 plotHistograms = False
+# where to save the Vcrit of each chip and channel (see thresholds.py), if anywhere
+thresholdsFile = None
+# skip searching the pulser magnitudes below the ledge onset (see waveformCollection.scan_vcrit);
+# the areas of the skipped magnitudes are then left at 0
+scanVcrit = False
+# how to spread the Vcrit fits (and the scan) over the chips and channels:
+# "serial", "threads" or "processes"
+executor = "serial"
 
-shape = (len(thisCollection.uniques['ID']),
-         len(thisCollection.uniques['channel']),
-         len(thisCollection.uniques['ExtPulserMag']))
-Vcrit = np.zeros(shape)
-leftA = np.zeros(shape)
-rightA = np.zeros(shape)
+V = thisCollection.uniques['ExtPulserMag']
 
-hasLedge = np.zeros(shape, dtype = bool)
-leftLobe = np.zeros(shape, dtype = bool)
-rightLobe = np.zeros(shape, dtype = bool)
+if scanVcrit:
+    fits = thisCollection.scan_vcrit(executor = executor)
 
-V = thisCollection.uniques['ExtPulserMag']
+# areas and ledge flags with shape (ID, channel, ExtPulserMag)
+areas = thisCollection.ledge_areas(search = not scanVcrit)
+leftA = areas['leftA']
+rightA = areas['rightA']
+hasLedge = areas['hasLedge']
 
-for i, (chip, subCollection) in enumerate(thisCollection.byHeaderCol('ID')):
-    # print "chip:", chip
-        
-    for j, (channel, perChannelCollection) in enumerate(subCollection.byHeaderCol('channel')):
-        # print "channel:", channel
-        
-        for k, (pulserMag, perVoltageCollection) in enumerate(perChannelCollection.byHeaderCol('ExtPulserMag')):
-            # print "pulser V:", pulserMag, "V" 
-            
-            for wf in perVoltageCollection.waveforms:
-                wf.find_ledge()
-                if plotWaveforms:
-                    wf.plot()
-
-                hasLedge[i, j, k] = wf.hasLedge
-                leftLobe[i, j, k] = wf.leftLobe
-                rightLobe[i, j, k] = wf.rightLobe
-
-                if wf.hasLedge:
-                    if wf.leftLobe:
-                        leftArea = np.sum(wf.samples[(wf.ticks > wf.ledgeEdge[0]) &
-                                                     (wf.ticks < wf.zeroCrossing)]
-                                          - wf.baseline)
-                    else:
-                        leftArea = 0
-                    if wf.rightLobe:
-                        rightArea = np.sum(wf.samples[(wf.ticks < wf.ledgeEdge[1]) &
-                                                      (wf.ticks > wf.zeroCrossing)]
-                                           - wf.baseline)
-                    else:
-                        rightArea = 0
-                        
-                    leftA[i,j,k] = leftArea
-                    rightA[i,j,k] = rightArea
-
-
-        if all(leftA[i, j, :] == 0):
-            thisVcrit = np.nan
-        else:
-            leftMask = (~hasLedge[i, j, :]) | (hasLedge[i, j, :] & leftLobe[i, j, :])
-            leftV = V[leftMask]
-            leftData = leftA[i, j, leftMask]
-            leftArgs = fit_model(leftV,
-                                 leftData,
-                                 quadratic_model,
-                                 [1, 1, 1],
-                                 bounds = [(None, 0),
-                                           (None, None),
-                                           (None, None)])
-        
-            rightMask = (~hasLedge[i, j, :]) | (hasLedge[i, j, :] & rightLobe[i, j, :])
-            rightV = V[rightMask]
-            rightData = rightA[i, j, rightMask]
-            rightArgs = fit_model(rightV,
-                                  np.abs(rightData),
-                                  quadratic_model,
-                                  [1, 1, 1],
-                                  bounds = [(None, 0),
-                                            (None, None),
-                                            (None, None)])
-        
-            bf = fit_coupled_models(leftV,
-                                    rightV,
-                                    leftData,
-                                    np.abs(rightData),
-                                    quadratic_model,
-                                    quadratic_zero_coupling,
-                                    np.concatenate((leftArgs, rightArgs[:-1])),
-                                    bounds = [(None, 0),
-                                              (None, None),
-                                              (None, None),
-                                              (None, 0),
-                                              (None, None)])
-
-            leftArgs, rightArgs = quadratic_zero_coupling(*bf)
-            thisVcrit = quadratic_solution(*leftArgs)
-
-        # print "Vcrit:", round(thisVcrit, 2), "V"
-        
-        Vcrit[i, j, k] = thisVcrit
+if plotWaveforms:
+    for wf in thisCollection:
+        wf.plot()
+
+# Vcrit and the fits, with shape (ID, channel)
+if not scanVcrit:
+    fits = extract_vcrit(V, executor = executor, **areas)
+Vcrit = fits['Vcrit']
+
+if thresholdsFile:
+    thresholdTable.from_vcrit(fits,
+                              thisCollection.uniques['ID'],
+                              thisCollection.uniques['channel'],
+                              run = V7_run1[8].fileName).write(thresholdsFile)
+
+for i, chip in enumerate(thisCollection.uniques['ID']):
+    for j, channel in enumerate(thisCollection.uniques['channel']):
+        thisVcrit = Vcrit[i, j]
 
         print chip, channel, thisVcrit
 
-        if plotRegressions:
-            plt.scatter(leftV, leftData, label = "Positive lobe", marker = '+')
-            plt.scatter(rightV, np.abs(rightData), label = "Negative lobe", marker = '+')
+        if plotRegressions and np.isfinite(thisVcrit):
+            leftMask = (~hasLedge[i, j, :]) | (hasLedge[i, j, :] & areas['leftLobe'][i, j, :])
+            rightMask = (~hasLedge[i, j, :]) | (hasLedge[i, j, :] & areas['rightLobe'][i, j, :])
+            leftArgs = fits['leftArgs'][i, j]
+            rightArgs = fits['rightArgs'][i, j]
+
+            plt.scatter(V[leftMask], leftA[i, j, leftMask], label = "Positive lobe", marker = '+')
+            plt.scatter(V[rightMask], np.abs(rightA[i, j, rightMask]), label = "Negative lobe", marker = '+')
 
             plt.plot(model_V_space, quadratic_model(model_V_space, *leftArgs))
             plt.plot(model_V_space, quadratic_model(model_V_space, *rightArgs))
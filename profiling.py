@@ -0,0 +1,146 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+import functools
+import contextlib
+
+from collections import OrderedDict
+
+def switched_on(setting):
+    "whether an environment setting turns something on: anything but unset, empty, 0, false, no or off"
+    return (setting or "").strip().lower() not in ("", "0", "false", "no", "off")
+
+# set COLDANA_PROFILE to 1 to print a report of the instrumented stages when the program
+# exits, or to the name of a .json file to save the report there instead
+enabled = switched_on(os.environ.get("COLDANA_PROFILE"))
+
+# name: {"count", "seconds", "peakGrowthMB", "rssGrowthMB"} for each stage seen so far
+stages = OrderedDict()
+lock = threading.Lock()
+
+def rss():
+    "the current resident memory of this process in MB, or 0 where it cannot be read"
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1])*resource.getpagesize()/2.**20
+    except (IOError, OSError, IndexError, ValueError):
+        return 0.
+
+def peak_rss():
+    "the peak resident memory of this process so far, in MB"
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak/2.**20
+    return peak/2.**10
+
+class stage(object):
+    """
+    a context manager which, while profiling is enabled, adds the wall time of its block
+    and the growth in resident memory (the net change, and how much the peak rose) to the
+    totals of the named stage.  Stages can be nested, and each one counts everything inside it
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.active = enabled
+        if self.active:
+            self.startRSS = rss()
+            self.startPeak = peak_rss()
+            self.start = time.time()
+        return self
+
+    def __exit__(self, *exception):
+        if self.active:
+            record(self.name, time.time() - self.start,
+                   peak_rss() - self.startPeak, rss() - self.startRSS)
+        return False
+
+def record(name, seconds, peakGrowth = 0., rssGrowth = 0.):
+    "add one call of a stage to its totals"
+    with lock:
+        totals = stages.setdefault(name, {"count": 0,
+                                          "seconds": 0.,
+                                          "peakGrowthMB": 0.,
+                                          "rssGrowthMB": 0.})
+        totals["count"] += 1
+        totals["seconds"] += seconds
+        totals["peakGrowthMB"] += peakGrowth
+        totals["rssGrowthMB"] += rssGrowth
+
+def profiled(name):
+    "decorate a function so that each call is timed as the named stage (see stage)"
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def reset():
+    "forget the totals of every stage"
+    with lock:
+        stages.clear()
+
+def report_rows():
+    "the totals of each stage, slowest first, as a list of dicts"
+    with lock:
+        rows = [dict(totals, stage = name) for name, totals in stages.items()]
+    for row in rows:
+        row["perCallMs"] = 1e3*row["seconds"]/row["count"]
+    return sorted(rows, key = lambda row: -row["seconds"])
+
+def print_report(outFile = None):
+    "print a table of the stage totals"
+    outFile = outFile or sys.stdout
+    outFile.write("%-24s %8s %10s %10s %12s %12s\n" % ("stage", "calls", "seconds", "ms/call",
+                                                     "peak MB +", "RSS MB +"))
+    for row in report_rows():
+        outFile.write("%-24s %8d %10.3f %10.3f %12.1f %12.1f\n" % (row["stage"], row["count"], row["seconds"],
+                                                                 row["perCallMs"], row["peakGrowthMB"],
+                                                                 row["rssGrowthMB"]))
+
+def save_report(fileName):
+    "write the stage totals to a JSON file"
+    with open(fileName, "w") as outFile:
+        json.dump(report_rows(), outFile, indent = 1)
+
+@contextlib.contextmanager
+def profile(fileName = None, show = True):
+    """
+    enable profiling within a with block, starting from empty totals.  At the end the
+    report is printed (unless show is False) and saved to fileName if one is given.
+    The block is given the dict of stage totals
+    """
+    global enabled
+    previous = enabled
+    enabled = True
+    reset()
+    try:
+        yield stages
+    finally:
+        enabled = previous
+        if show:
+            print_report()
+        if fileName:
+            save_report(fileName)
+
+def report_at_exit():
+    "the report asked for by COLDANA_PROFILE"
+    if not stages:
+        return
+    target = os.environ.get("COLDANA_PROFILE", "")
+    if target.endswith(".json"):
+        save_report(target)
+    else:
+        print_report(sys.stderr)
+
+if enabled:
+    atexit.register(report_at_exit)
@@ -0,0 +1,232 @@
+import os
+import json
+import sqlite3
+import hashlib
+
+from coldAna import *
+from utils import *
+
+def parameter_hash(parameters = {}):
+    """
+    a short hash of the ledge search settings (ledgeParameters, overridden by parameters),
+    so that results found with different settings are kept apart
+    """
+    settings = dict(ledgeParameters, **parameters)
+    return hashlib.sha1(json.dumps(settings, sort_keys = True).encode("utf-8")).hexdigest()[:16]
+
+def fit_hash(parameters = {}, selection = None):
+    """
+    the key of the Vcrit fits made with some ledge search settings from the waveforms
+    matching a selection dict.  Without a selection this is parameter_hash, but a fit of
+    a selection (e.g. some of the pulser magnitudes) is kept apart from the fit of the whole file
+    """
+    if not selection:
+        return parameter_hash(parameters)
+    settings = dict(ledgeParameters, **parameters)
+    selection = dict((key, np.asarray(value).tolist()) for key, value in selection.items())
+    return hashlib.sha1(json.dumps([settings, selection], sort_keys = True).encode("utf-8")).hexdigest()[:16]
+
+def waveform_keys(headers):
+    """
+    identify each waveform by the values of its header fields, followed by the number of
+    earlier waveforms in the same table with the same header (so that repeated
+    acquisitions with identical headers are told apart by their order)
+    """
+    keys = np.array([json.dumps(record) for record in headers.tolist()])
+    if not len(keys):
+        return keys
+    values, codes = np.unique(keys, return_inverse = True)
+    order = np.argsort(codes, kind = "mergesort")
+    firsts = np.cumsum(np.bincount(codes, minlength = len(values))) - np.bincount(codes, minlength = len(values))
+    occurrence = np.empty(len(keys), dtype = int)
+    occurrence[order] = np.arange(len(keys)) - firsts[codes[order]]
+    return np.array([key + "#" + str(n) for key, n in zip(keys, occurrence)])
+
+class resultsStore(object):
+    """
+    a sqlite database of analysis results which persists between runs: the ledge
+    search result of each waveform and the Vcrit fit of each chip and channel,
+    keyed by data file, waveform header (see waveform_keys) and the hash of the ledge
+    search settings.  Only the waveforms and channels without a stored result are
+    analysed, and results are saved as they are found, so an interrupted run can be resumed
+    """
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.db = sqlite3.connect(fileName)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS sources (file TEXT PRIMARY KEY, signature TEXT);
+            CREATE TABLE IF NOT EXISTS ledges (file TEXT, parameters TEXT, waveform TEXT,
+                                               hasLedge INTEGER, leftLobe INTEGER, rightLobe INTEGER,
+                                               leftEdge INTEGER, rightEdge INTEGER, zeroCrossing REAL,
+                                               PRIMARY KEY (file, parameters, waveform));
+            CREATE TABLE IF NOT EXISTS fits (file TEXT, parameters TEXT, ID TEXT, channel INTEGER,
+                                             Vcrit REAL, leftArgs TEXT, rightArgs TEXT,
+                                             chi2 REAL, nfev INTEGER, status INTEGER, success INTEGER,
+                                             PRIMARY KEY (file, parameters, ID, channel));
+            CREATE TABLE IF NOT EXISTS finished (file TEXT, parameters TEXT,
+                                                 PRIMARY KEY (file, parameters));
+            """)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def file_key(self, thisFile):
+        """
+        the key of a dataFile's results.  If the file has changed since its results
+        were stored, they are deleted, so that everything is found again
+        """
+        fileKey = os.path.abspath(thisFile.fileName)
+        signature = json.dumps(thisFile.source_signature(), sort_keys = True)
+        stored = self.db.execute("SELECT signature FROM sources WHERE file = ?", (fileKey,)).fetchone()
+        if stored is None or stored[0] != signature:
+            for table in ["ledges", "fits", "finished"]:
+                self.db.execute("DELETE FROM " + table + " WHERE file = ?", (fileKey,))
+            self.db.execute("INSERT OR REPLACE INTO sources VALUES (?, ?)", (fileKey, signature))
+            self.db.commit()
+
+        return fileKey
+
+    def find_ledge(self, collection, thisFile, chunkSize = 256, **parameters):
+        """
+        fill in the ledge search results of every waveform in a collection loaded from
+        thisFile (see waveformCollection.find_ledge), taking them from the database where
+        they are stored and searching the others, chunkSize waveforms at a time.
+        Returns the number of waveforms which had to be searched
+        """
+        fileKey = self.file_key(thisFile)
+        parameterKey = parameter_hash(parameters)
+        store = collection.store
+        keys = waveform_keys(collection.headers)
+
+        stored = dict((row[0], row[1:]) for row in
+                      self.db.execute("SELECT waveform, hasLedge, leftLobe, rightLobe, "
+                                      "leftEdge, rightEdge, zeroCrossing FROM ledges "
+                                      "WHERE file = ? AND parameters = ?",
+                                      (fileKey, parameterKey)))
+        found = np.array([key in stored for key in keys], dtype = bool)
+        if np.any(found):
+            values = np.array([stored[key] for key in keys[found]], dtype = float).reshape(-1, 6)
+            store.record_ledges(collection.positions[found],
+                                {"hasLedge": values[:, 0] > 0,
+                                 "leftLobe": values[:, 1] > 0,
+                                 "rightLobe": values[:, 2] > 0,
+                                 "ledgeEdge": values[:, 3:5].astype(int),
+                                 "zeroCrossing": values[:, 5]})
+
+        missing = np.flatnonzero(~found)
+        for start in range(0, len(missing), chunkSize):
+            chunk = missing[start:start + chunkSize]
+            positions = collection.positions[chunk]
+            result = find_ledges(store.samples[positions], store.baseline[positions], **parameters)
+            store.record_ledges(positions, result)
+            self.db.executemany("INSERT OR REPLACE INTO ledges VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(fileKey, parameterKey, keys[i],
+                                  int(hasLedge), int(leftLobe), int(rightLobe),
+                                  int(edge[0]), int(edge[1]),
+                                  None if np.isnan(zeroCrossing) else float(zeroCrossing))
+                                 for i, hasLedge, leftLobe, rightLobe, edge, zeroCrossing
+                                 in zip(chunk, result["hasLedge"], result["leftLobe"], result["rightLobe"],
+                                        result["ledgeEdge"], result["zeroCrossing"])])
+            self.db.commit()
+
+        return len(missing)
+
+    def vcrit(self, collection, thisFile, executor = "serial", nWorkers = None, selection = None, **parameters):
+        """
+        Vcrit of every chip and channel of a collection loaded from thisFile
+        (see utils.extract_vcrit), fitting only the channels without a stored fit.
+        If the collection holds only the waveforms matching a selection dict, pass it
+        as selection, so that its fits are stored apart from those of the whole file.
+        Returns the same dict of arrays with shape (chip, channel) as extract_vcrit
+        """
+        fileKey = self.file_key(thisFile)
+        parameterKey = fit_hash(parameters, selection)
+        chips = collection.uniques["ID"]
+        channels = collection.uniques["channel"]
+
+        stored = self.stored_fits(fileKey, parameterKey)
+        missing = [(i, j) for i, chip in enumerate(chips) for j, channel in enumerate(channels)
+                   if not (chip, int(channel)) in stored]
+
+        if missing:
+            self.find_ledge(collection, thisFile, **parameters)
+            areas = collection.ledge_areas(search = False)
+            cells = tuple(np.array(missing).T)
+            fits = extract_vcrit(collection.uniques["ExtPulserMag"],
+                                 executor = executor, nWorkers = nWorkers,
+                                 **{name: values[cells] for name, values in areas.items()})
+            rows = []
+            for n, (i, j) in enumerate(missing):
+                row = (None if np.isnan(fits["Vcrit"][n]) else float(fits["Vcrit"][n]),
+                       json.dumps(fits["leftArgs"][n].tolist()),
+                       json.dumps(fits["rightArgs"][n].tolist()),
+                       None if np.isnan(fits["chi2"][n]) else float(fits["chi2"][n]),
+                       int(fits["nfev"][n]), int(fits["status"][n]), int(fits["success"][n]))
+                stored[(chips[i], int(channels[j]))] = row
+                rows.append((fileKey, parameterKey, chips[i], int(channels[j])) + row)
+            self.db.executemany("INSERT OR REPLACE INTO fits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.db.commit()
+
+        return self.fit_arrays(stored, chips, channels)
+
+    def stored_fits(self, fileKey, parameterKey):
+        "the stored fits of a file, as a dict of (ID, channel): database row"
+        return dict(((row[0], row[1]), row[2:]) for row in
+                    self.db.execute("SELECT ID, channel, Vcrit, leftArgs, rightArgs, "
+                                    "chi2, nfev, status, success FROM fits "
+                                    "WHERE file = ? AND parameters = ?",
+                                    (fileKey, parameterKey)))
+
+    def fit_arrays(self, stored, chips, channels):
+        "arrange stored fits (see stored_fits) into arrays with shape (chip, channel), like extract_vcrit"
+        shape = (len(chips), len(channels))
+        result = {"Vcrit": np.full(shape, np.nan),
+                  "leftArgs": np.full(shape + (3,), np.nan),
+                  "rightArgs": np.full(shape + (3,), np.nan),
+                  "chi2": np.full(shape, np.nan),
+                  "nfev": np.zeros(shape, dtype = int),
+                  "status": np.zeros(shape, dtype = int),
+                  "success": np.zeros(shape, dtype = bool)}
+        for i, chip in enumerate(chips):
+            for j, channel in enumerate(channels):
+                Vcrit, leftArgs, rightArgs, chi2, nfev, status, success = stored[(chip, int(channel))]
+                result["Vcrit"][i, j] = np.nan if Vcrit is None else Vcrit
+                result["leftArgs"][i, j] = json.loads(leftArgs)
+                result["rightArgs"][i, j] = json.loads(rightArgs)
+                result["chi2"][i, j] = np.nan if chi2 is None else chi2
+                result["nfev"][i, j] = nfev
+                result["status"][i, j] = status
+                result["success"][i, j] = success
+
+        return result
+
+    def run(self, files, selection = None, executor = "serial", nWorkers = None, **parameters):
+        """
+        find Vcrit for every file in a list of dataFiles (or a runCatalog), returning a list
+        of (dataFile, result of vcrit) pairs.  Files which were finished by an earlier run with
+        the same settings are not loaded again, and an interrupted run picks up where it stopped
+        """
+        parameterKey = parameter_hash(parameters)
+        results = []
+        for thisFile in files:
+            if isinstance(thisFile, tuple):
+                # the (dataFile, coordinates) pairs of a runCatalog
+                thisFile = thisFile[0]
+            fileKey = self.file_key(thisFile)
+            finished = self.db.execute("SELECT 1 FROM finished WHERE file = ? AND parameters = ?",
+                                       (fileKey, parameterKey)).fetchone()
+            if finished and not selection:
+                stored = self.stored_fits(fileKey, parameterKey)
+                results.append((thisFile, self.fit_arrays(stored,
+                                                          sorted(set(chip for chip, channel in stored)),
+                                                          sorted(set(channel for chip, channel in stored)))))
+                continue
+
+            collection = thisFile.load(selection)
+            results.append((thisFile, self.vcrit(collection, thisFile, executor, nWorkers, selection, **parameters)))
+            if not selection:
+                self.db.execute("INSERT OR REPLACE INTO finished VALUES (?, ?)", (fileKey, parameterKey))
+                self.db.commit()
+
+        return results
@@ -0,0 +1,120 @@
+import os
+import argparse
+
+import numpy as np
+
+# the default grid of a synthetic file: 16 channels per chip, pulser magnitudes from 0.1 to 1.6 V
+defaultChannels = range(16)
+defaultPulserMags = [round(0.1*i, 1) for i in range(1, 17)]
+
+def pulse_shape(ticks, start, peakingTicks, order = 4):
+    "a CR-RC^order shaper response starting at tick start, peaking after peakingTicks with a height of 1"
+    x = np.clip((ticks - start)/float(peakingTicks)*order, 0, None)
+    return (x/order)**order*np.exp(order - x)
+
+def step(ticks, position, width):
+    "a smooth step from 0 to 1 at position, width ticks wide"
+    return 0.5*(1 + np.tanh((ticks - position)/(2.*width)))
+
+def synthetic_samples(pulserMag, vcrit, rng, nSamples = 4000, noise = 10.):
+    """
+    the ADC samples of one synthetic waveform: a baseline near 900 counts with white noise,
+    the shaped response to the external pulser, and, if pulserMag is above vcrit,
+    a ledge after the pulse whose height grows with pulserMag - vcrit, with sharp edges
+    (and an undershooting right lobe half of the time).
+    Returns the samples and whether a ledge was added
+    """
+    ticks = np.arange(nSamples)
+    baseline = 900 + rng.randint(-50, 50)
+    samples = baseline + rng.normal(0, noise, nSamples)
+    pulseStart = 0.05*nSamples
+    # 2 usec peaking time, at 4 MHz
+    samples += 3000*pulserMag*pulse_shape(ticks, pulseStart, 8)
+
+    hasLedge = pulserMag > vcrit
+    if hasLedge:
+        height = 150 + 600*(pulserMag - vcrit)
+        ledgeStart = pulseStart + rng.randint(nSamples//10, 7*nSamples//20)
+        ledgeEnd = ledgeStart + rng.randint(nSamples//20, 3*nSamples//20)
+        samples += height*(step(ticks, ledgeStart, 2) - step(ticks, ledgeEnd, 2))
+        if rng.rand() < 0.5:
+            recovery = ledgeEnd + rng.randint(nSamples//40, nSamples//10)
+            samples -= 0.75*height*(step(ticks, ledgeEnd, 2) - step(ticks, recovery, 2))
+
+    # a 14-bit ADC
+    return np.clip(np.round(samples), 0, 2**14 - 1).astype(int), hasLedge
+
+def synthetic_header(chip, socket, channel, pulserMag, nSamples, chipType = "v7"):
+    "the 13 header fields of a synthetic waveform, as strings"
+    return [chip, chipType, str(socket), str(channel),
+            "9D",   # test pulse on, 900 mV baseline, 14 mV/fC, 2 usec
+            "00", "00", "00", "0",
+            str(pulserMag), "1", "77", str(nSamples)]
+
+def write_dat(fileName, nWaveforms = None, nBytes = None, chips = None,
+              channels = defaultChannels, pulserMags = defaultPulserMags,
+              nSamples = 4000, noise = 10., seed = 0):
+    """
+    write a synthetic data file in the DAQ format (see README), going through the grid of
+    chips x channels x pulserMags with one waveform per cell.  Each channel has a random
+    Vcrit between 0.2 and 1.4 V, above which its waveforms have a ledge.
+    The size can be given as a number of waveforms (nWaveforms) or of bytes (nBytes,
+    stopping at the first line past it); by default the whole grid is written once.
+    Chips are named S0000, S0001, ... unless a list is given, and are added as needed.
+    Lines are written as they are made, so files of any size fit in memory.
+    Returns the number of waveforms and of waveforms with a ledge
+    """
+    rng = np.random.RandomState(seed)
+    if nWaveforms is None and nBytes is None:
+        nWaveforms = len(chips or ["S0000"])*len(channels)*len(pulserMags)
+
+    written = 0
+    ledges = 0
+    size = 0
+    chipNumber = 0
+    with open(fileName, "w") as outFile:
+        while True:
+            if chips and chipNumber < len(chips):
+                chip = chips[chipNumber]
+            else:
+                chip = "S%04d" % chipNumber
+            for channel in channels:
+                vcrit = rng.uniform(0.2, 1.4)
+                for pulserMag in pulserMags:
+                    if ((nWaveforms is not None and written >= nWaveforms) or
+                        (nBytes is not None and size >= nBytes)):
+                        return written, ledges
+                    samples, hasLedge = synthetic_samples(pulserMag, vcrit, rng, nSamples, noise)
+                    line = " ".join(synthetic_header(chip, chipNumber, channel, pulserMag, nSamples) +
+                                    [str(value) for value in samples.tolist()]) + "\n"
+                    outFile.write(line)
+                    written += 1
+                    ledges += hasLedge
+                    size += len(line)
+            chipNumber += 1
+
+def parse_size(text):
+    "a size like 500MB or 2GB, in bytes"
+    units = {"KB": 2**10, "MB": 2**20, "GB": 2**30}
+    text = text.strip().upper()
+    for unit, factor in units.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)])*factor)
+    return int(text)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "write a synthetic FEASIC data file")
+    parser.add_argument("fileName")
+    parser.add_argument("--waveforms", type = int, default = None, help = "number of waveforms to write")
+    parser.add_argument("--size", type = parse_size, default = None, help = "file size to reach, e.g. 2GB")
+    parser.add_argument("--chips", nargs = "+", default = None)
+    parser.add_argument("--channels", type = int, default = len(defaultChannels), help = "channels per chip")
+    parser.add_argument("--mags", type = float, nargs = "+", default = defaultPulserMags,
+                        help = "pulser magnitudes in V")
+    parser.add_argument("--samples", type = int, default = 4000, help = "samples per waveform")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    written, ledges = write_dat(args.fileName, args.waveforms, args.size, args.chips,
+                                range(args.channels), args.mags, args.samples, seed = args.seed)
+    print "wrote", written, "waveforms (" + str(ledges), "with a ledge),", os.path.getsize(args.fileName), "bytes"
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import write_dat
+
+# a small synthetic file: 2 chips x 4 channels x 8 pulser magnitudes, with ledges above each channel's Vcrit
+syntheticGrid = {"chips": ["S0", "S1"],
+                 "channels": range(4),
+                 "pulserMags": [0.2, 0.4, 0.6, 0.8, 1.0, 1.2, 1.4, 1.6],
+                 "nSamples": 2000}
+
+@pytest.fixture(scope = "session")
+def syntheticFile(tmpdir_factory):
+    "the name of a small synthetic data file, written once per test session"
+    fileName = str(tmpdir_factory.mktemp("synthetic").join("synthetic.dat"))
+    write_dat(fileName, **syntheticGrid)
+    return fileName
+
+# a dense pulser scan: 1 chip x 8 channels x 32 pulser magnitudes.  With 4000 ticks every ledge
+# above Vcrit is found; with 2000 ticks many start before searchStart and are missed
+denseGrid = {"chips": ["S0"],
+             "channels": range(8),
+             "pulserMags": [round(0.05*(i + 1), 2) for i in range(32)]}
+
+@pytest.fixture(scope = "session", params = [4000, 2000], ids = ["clean", "missed"])
+def denseFile(request, tmpdir_factory):
+    "the name of a synthetic data file of a dense scan, and its number of ticks"
+    nSamples = request.param
+    fileName = str(tmpdir_factory.mktemp("dense").join("dense" + str(nSamples) + ".dat"))
+    write_dat(fileName, nSamples = nSamples, **denseGrid)
+    return fileName, nSamples
@@ -0,0 +1,72 @@
+"""
+the straightforward versions of the analyses, as they were before they were vectorized,
+which the fast paths are checked against
+"""
+import numpy as np
+
+def parse(fileName, headerSize = 13):
+    "the header strings and samples of a data file, read by np.loadtxt in two passes"
+    headerStrings = np.loadtxt(fileName, usecols = range(headerSize), dtype = str, ndmin = 2)
+    nSamples = int(headerStrings[0][12])
+    samples = np.loadtxt(fileName, usecols = range(headerSize, headerSize + nSamples), ndmin = 2)
+    return headerStrings, samples
+
+def find_ledge(samples, baseline):
+    "the ledge search of a single waveform, returning hasLedge, leftLobe, rightLobe, ledgeEdge and zeroCrossing"
+    ticks = np.arange(len(samples))
+
+    window_size = 15
+    fringe_size = window_size//2
+    smoothingFilter = (1/float(window_size))*np.ones(window_size)
+    diff = np.diff(samples, n = 1, prepend = baseline)
+    smoothed = np.convolve(diff, smoothingFilter)[fringe_size:-fringe_size]
+    for i in range(fringe_size):
+        smoothed[i] = 0
+        smoothed[-i-1] = 0
+
+    noise = []
+    noiseWindowSize = 30
+    for i in range(len(samples) - noiseWindowSize):
+        noise.append(np.std(samples[i:i+noiseWindowSize]))
+    noise = np.array(noiseWindowSize//2*[0] + noise + noiseWindowSize//2*[0])
+
+    # the fraction of the ticks with a larger rolling std than each tick
+    P = np.sum([noise < ni for ni in noise], axis = 0, dtype = float)/float(len(noise))
+    noisyPeaks = ticks[(ticks > 400) &
+                       (noise > 18) &
+                       (P < 0.03) &
+                       (np.diff(noise, n = 1, prepend = 0) > 0)]
+    peaks = []
+    for nP in noisyPeaks:
+        win = abs(ticks - nP) < 150
+        candidatePeaks = sorted(ticks[(noise == np.max(noise[win])) &
+                                      (smoothed >= 0) &
+                                      (win)])
+        if candidatePeaks:
+            if not candidatePeaks[0] in peaks:
+                peaks.append(candidatePeaks[0])
+
+    if not peaks:
+        return {"hasLedge": False, "leftLobe": False, "rightLobe": False,
+                "ledgeEdge": None, "zeroCrossing": None}
+
+    if len(peaks) == 1:
+        win = ticks > peaks[0]
+        edge = peaks
+    else:
+        win = (ticks > peaks[0]) & (ticks < peaks[-1])
+        edge = [peaks[0], peaks[-1]]
+    isMin = ((samples - baseline)**2 == np.min((samples[win] - baseline)**2))
+    return {"hasLedge": True, "leftLobe": True, "rightLobe": len(peaks) >= 2,
+            "ledgeEdge": edge, "zeroCrossing": np.median(ticks[win & isMin])}
+
+def lobe_areas(samples, baseline, ledge):
+    "the left and right lobe areas of a waveform with the result of find_ledge, summed over masks of the ticks"
+    ticks = np.arange(len(samples))
+    if not ledge["hasLedge"]:
+        return 0., 0.
+    left = np.sum(samples[(ticks > ledge["ledgeEdge"][0]) & (ticks < ledge["zeroCrossing"])] - baseline)
+    right = 0.
+    if ledge["rightLobe"]:
+        right = np.sum(samples[(ticks > ledge["zeroCrossing"]) & (ticks < ledge["ledgeEdge"][1])] - baseline)
+    return left, right
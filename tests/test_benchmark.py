@@ -0,0 +1,7 @@
+import benchmark
+
+def test_scales_can_start_worker_processes(tmpdir):
+    results = benchmark.run([32], str(tmpdir), executor = "processes")
+
+    assert [row["stage"] for row in results] == [stage for stage, unit in benchmark.stageUnits]
+    assert all(row["scale"] == 32 and row["seconds"] > 0 for row in results)
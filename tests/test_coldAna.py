@@ -0,0 +1,134 @@
+import math
+
+import numpy as np
+import pytest
+
+import reference
+import utils
+from coldData import dataFile, screen_ledges, waveformCollection, waveformStore
+
+def test_find_ledge_matches_reference(syntheticFile):
+    collection = dataFile(syntheticFile).load()
+    collection.find_ledge()
+
+    assert np.any(collection.store.hasLedge)
+    for wf in collection:
+        expected = reference.find_ledge(wf.samples, wf.baseline)
+        assert wf.hasLedge == expected["hasLedge"]
+        assert wf.leftLobe == expected["leftLobe"]
+        assert wf.rightLobe == expected["rightLobe"]
+        assert wf.ledgeEdge == expected["ledgeEdge"]
+        assert wf.zeroCrossing == expected["zeroCrossing"]
+
+def test_single_waveform_matches_collection(syntheticFile):
+    collection = dataFile(syntheticFile).load()
+    collection.find_ledge()
+    single = dataFile(syntheticFile).load()
+    for wf in single:
+        wf.find_ledge()
+
+    for column in ["hasLedge", "leftLobe", "rightLobe", "ledgeEdge"]:
+        assert np.array_equal(getattr(single.store, column), getattr(collection.store, column))
+
+def test_lobe_areas_match_reference(syntheticFile):
+    collection = dataFile(syntheticFile).load()
+    collection.find_ledge()
+    leftA, rightA = collection.lobe_areas()
+
+    for wf, left, right in zip(collection, leftA, rightA):
+        expected = reference.lobe_areas(wf.samples, wf.baseline,
+                                        reference.find_ledge(wf.samples, wf.baseline))
+        assert np.allclose([left, right], expected)
+
+def test_screened_search_matches_full(syntheticFile):
+    full = dataFile(syntheticFile).load()
+    fullCounts = full.find_ledge()
+    screened = dataFile(syntheticFile).load()
+    counts = screened.find_ledge(screen = True)
+
+    assert counts["screened"] == len(screened)
+    assert counts["searched"] < len(screened)
+    assert counts["found"] == fullCounts["found"]
+    for column in ["hasLedge", "leftLobe", "rightLobe", "ledgeEdge"]:
+        assert np.array_equal(getattr(screened.store, column), getattr(full.store, column))
+
+    # every waveform with a ledge passes the screen
+    assert np.all(screen_ledges(full.samples)[full.store.hasLedge])
+
+def test_statistics_cache_is_bounded(syntheticFile):
+    full = dataFile(syntheticFile).load()
+    full.find_ledge()
+    bounded = dataFile(syntheticFile).load()
+    bounded.store.stats.cacheBytes = 2**20
+    bounded.find_ledge(chunkSize = 16)
+    bounded.lobe_areas(chunkSize = 16)
+
+    stats = bounded.store.stats
+    assert 0 < stats.cachedBytes <= stats.cacheBytes
+    assert stats.cachedBytes == sum(row.nbytes for row in stats.cache.values())
+    for column in ["hasLedge", "leftLobe", "rightLobe", "ledgeEdge"]:
+        assert np.array_equal(getattr(bounded.store, column), getattr(full.store, column))
+
+def peak(wf):
+    return np.max(wf.samples)
+
+def test_repeated_cell_keeps_last_waveform(syntheticFile):
+    original = dataFile(syntheticFile).load()
+    # a repeated acquisition of the first waveform, with a different pulse
+    store = waveformStore.concatenate([(original.store, original.positions), (original.store, [0])])
+    store.samples[-1] = store.samples[-1] + 100
+    repeated = waveformCollection(store = store)
+    iterkeys = ["ID", "channel", "ExtPulserMag"]
+
+    expected = original.broadcast(peak, iterkeys)
+    last = repeated.broadcast(peak, iterkeys)
+    first = repeated.broadcast(peak, iterkeys, duplicates = "first")
+    cell = tuple(np.searchsorted(original.uniques[key], original.column(key)[0]) for key in iterkeys)
+    assert last[cell] == expected[cell] + 100
+    last[cell] = expected[cell]
+    assert np.array_equal(last, expected)
+    assert np.array_equal(first, expected)
+
+    with pytest.raises(ValueError) as error:
+        repeated.broadcast(peak, iterkeys, duplicates = "error")
+    assert "2 waveforms in the cell ID = " + str(original.column("ID")[0]) in str(error.value)
+
+    repeated.find_ledge()
+    areas = repeated.ledge_areas(search = False)
+    assert areas["leftA"].shape == expected.shape
+
+def test_scan_vcrit_matches_full_fit(syntheticFile):
+    full = dataFile(syntheticFile).load()
+    areas = full.ledge_areas()
+    expected = utils.extract_vcrit(full.uniques["ExtPulserMag"], **areas)
+
+    for coarse in [2, 3, 5]:
+        scan = dataFile(syntheticFile).load().scan_vcrit(coarse = coarse)
+        assert np.all(scan["visited"] <= len(full.uniques["ExtPulserMag"]))
+        assert np.allclose(scan["Vcrit"], expected["Vcrit"], equal_nan = True)
+
+def test_scan_vcrit_on_dense_scan(denseFile):
+    fileName, nSamples = denseFile
+    full = dataFile(fileName).load()
+    areas = full.ledge_areas()
+    expected = utils.extract_vcrit(full.uniques["ExtPulserMag"], **areas)
+    scan = dataFile(fileName).load().scan_vcrit()
+
+    assert np.allclose(scan["Vcrit"], expected["Vcrit"], equal_nan = True)
+    if nSamples == 4000:
+        # every ledge above Vcrit is found, so the magnitudes below the onset are skipped
+        assert np.sum(scan["visited"]) < 0.85*full.size
+    else:
+        # missed ledges make the channels fall back to a full search
+        assert np.sum(scan["visited"]) <= full.size
+
+def scalar_model(t, a, b):
+    "a model written for one tick at a time, which raises on an array of ticks"
+    return a + b*math.sqrt(t) if t > 0 else a
+
+def test_fit_model_takes_scalar_models(syntheticFile):
+    wf = next(iter(dataFile(syntheticFile).load()))
+    arrayArgs = wf.fit_model(lambda t, a, b: a + b*np.sqrt(t), [900., 1.], ax = None)
+    scalarArgs = wf.fit_model(scalar_model, [900., 1.], ax = None)
+
+    assert np.allclose(scalarArgs, arrayArgs)
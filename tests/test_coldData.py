@@ -0,0 +1,118 @@
+import numpy as np
+
+import reference
+from coldData import dataFile, collectionFile, runCatalog
+
+def test_parse_matches_loadtxt(syntheticFile):
+    headerStrings, samples = reference.parse(syntheticFile)
+    collection = dataFile(syntheticFile).load()
+
+    assert np.array_equal(collection.samples, samples)
+    assert np.array_equal(collection.column("ID"), headerStrings[:, 0])
+    assert np.array_equal(collection.column("channel"), headerStrings[:, 3].astype(int))
+    assert np.array_equal(collection.column("ExtPulserMag"), headerStrings[:, 9].astype(float))
+    assert np.array_equal(collection.column("N"), headerStrings[:, 12].astype(int))
+    assert set(collection.column("peakingTime")) == set(["2 usec"])
+
+def test_selection_matches_full_load(syntheticFile):
+    full = dataFile(syntheticFile).load()
+    selected = dataFile(syntheticFile).load({"ID": "S1", "channel": 2})
+
+    assert len(selected) == 8
+    assert np.array_equal(selected.samples, full[{"ID": "S1", "channel": 2}].samples)
+    assert np.array_equal(selected.headers, full[{"ID": "S1", "channel": 2}].headers)
+
+def test_selection_is_filtered_block_by_block(syntheticFile):
+    full = dataFile(syntheticFile).load()
+    with open(syntheticFile) as f:
+        headers, samples = dataFile(syntheticFile).parse(f, {"channel": 1}, blockSize = 5)
+
+    assert len(headers) == 16
+    assert np.array_equal(samples, full[{"channel": 1}].samples)
+    assert np.array_equal(headers, full[{"channel": 1}].headers)
+    with open(syntheticFile) as f:
+        assert len(dataFile(syntheticFile).parse(f, {"channel": 99}, blockSize = 5)[0]) == 0
+
+def test_collection_file_round_trip(syntheticFile, tmpdir):
+    collection = dataFile(syntheticFile).load()
+    collection.find_ledge()
+    fileName = str(tmpdir.join("collection.npz"))
+    collectionFile(fileName).write(collection, chunkSize = 10)
+
+    loaded = collectionFile(fileName).load()
+    assert np.array_equal(loaded.samples, collection.samples)
+    assert np.array_equal(loaded.headers, collection.headers)
+    for column in ["baseline", "hasLedge", "leftLobe", "rightLobe", "ledgeEdge"]:
+        assert np.array_equal(getattr(loaded.store, column), getattr(collection.store, column))
+    assert np.array_equal(np.isnan(loaded.store.zeroCrossing), np.isnan(collection.store.zeroCrossing))
+
+    selected = collectionFile(fileName).load({"channel": 3})
+    assert np.array_equal(selected.samples, collection[{"channel": 3}].samples)
+    assert len(collectionFile(fileName).load({"channel": 99})) == 0
+
+def test_cache_of_a_growing_file_is_out_of_date(syntheticFile, tmpdir):
+    lines = open(syntheticFile).readlines()
+    fileName = str(tmpdir.join("growing.dat"))
+    with open(fileName, "w") as f:
+        f.writelines(lines[:10])
+
+    class growingFile(dataFile):
+        "a dataFile whose file has ten more lines appended to it while it is parsed"
+        def parse(self, fileLines, selection = None):
+            result = dataFile.parse(self, fileLines, selection)
+            with open(self.fileName, "a") as f:
+                f.writelines(lines[10:20])
+            return result
+
+    assert len(growingFile(fileName, cache = True).load()) == 10
+    # the cache was stamped with the file as it was before the parse, so it is not trusted now
+    assert dataFile(fileName, cache = True).read_cache() is None
+    assert len(dataFile(fileName, cache = True).load()) == 20
+
+def test_cached_load_matches_uncached(syntheticFile, tmpdir):
+    uncached = dataFile(syntheticFile).load()
+    cacheDir = str(tmpdir.join("cache"))
+    dataFile(syntheticFile, cache = True, cacheDir = cacheDir).load()
+    cached = dataFile(syntheticFile, cache = True, cacheDir = cacheDir).load()
+
+    assert cached.store.samplesFile is not None
+    assert cached.samples.dtype == uncached.samples.dtype == np.float64
+    assert cached.waveforms[0].samples.dtype == np.float64
+    assert np.array_equal(cached.samples, uncached.samples)
+    assert np.array_equal(cached.baselines, uncached.baselines)
+    # arithmetic on the samples doesn't depend on how they were loaded
+    assert np.array_equal(cached.waveforms[3].samples - 1000, uncached.waveforms[3].samples - 1000)
+
+    cached.find_ledge()
+    uncached.find_ledge()
+    for column in ["hasLedge", "leftLobe", "rightLobe", "ledgeEdge"]:
+        assert np.array_equal(getattr(cached.store, column), getattr(uncached.store, column))
+
+def test_catalog_selects_and_merges_files(syntheticFile, tmpdir):
+    cacheDir = str(tmpdir.join("cache"))
+    cachedFile = dataFile(syntheticFile, cache = True, cacheDir = cacheDir)
+    cachedFile.load()
+    catalog = runCatalog([(dataFile(syntheticFile), {"batch": 1, "baselineSetting": 200}),
+                          (cachedFile, {"batch": 2, "baselineSetting": 200}),
+                          (dataFile(syntheticFile), {"batch": 1, "baselineSetting": 900})])
+
+    batches = catalog.select(baselineSetting = 200)
+    assert [coordinates["batch"] for thisFile, coordinates in batches] == [1, 2]
+    assert batches[1] is cachedFile
+
+    single = catalog.load(executor = "serial", batch = 2)
+    assert single.store.samplesFile == cachedFile.samples_file()
+    merged = batches.load(executor = "serial")
+    assert len(merged) == 2*len(single)
+    assert np.array_equal(merged[{"batch": 2}].samples, single.samples)
+
+def test_catalog_skips_empty_files(syntheticFile, tmpdir):
+    emptyFile = str(tmpdir.join("empty.dat"))
+    open(emptyFile, "w").close()
+    catalog = runCatalog([(dataFile(syntheticFile), {"batch": 1}), (dataFile(emptyFile), {"batch": 2})])
+
+    loaded = catalog.load(executor = "serial")
+    full = dataFile(syntheticFile).load()
+    assert np.array_equal(loaded.samples, full.samples)
+    assert set(loaded.column("batch")) == set([1])
+    assert len(catalog.load(executor = "serial", batch = 2)) == 0
@@ -0,0 +1,5 @@
+from profiling import switched_on
+
+def test_profile_setting_can_be_switched_off():
+    assert not any(switched_on(setting) for setting in [None, "", "0", "false", "No", " off "])
+    assert all(switched_on(setting) for setting in ["1", "yes", "profile.json"])
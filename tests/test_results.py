@@ -0,0 +1,20 @@
+import numpy as np
+
+from coldData import dataFile
+from results import resultsStore, parameter_hash, fit_hash
+
+def test_selected_fits_are_kept_apart(syntheticFile, tmpdir):
+    store = resultsStore(str(tmpdir.join("results.db")))
+    thisFile = dataFile(syntheticFile)
+    fileKey = store.file_key(thisFile)
+    (_, selected), = store.run([thisFile], selection = {"ID": "S1"})
+
+    assert selected["Vcrit"].shape == (1, 4)
+    assert not store.stored_fits(fileKey, parameter_hash())
+    assert len(store.stored_fits(fileKey, fit_hash({}, {"ID": "S1"}))) == 4
+
+    (_, full), = store.run([thisFile])
+    assert full["Vcrit"].shape == (2, 4)
+    assert len(store.stored_fits(fileKey, parameter_hash())) == 8
+    assert np.allclose(full["Vcrit"][1], selected["Vcrit"][0], equal_nan = True)
+    store.close()
@@ -0,0 +1,32 @@
+import numpy as np
+
+from thresholds import thresholdTable
+
+def test_write_read_round_trip(tmpdir):
+    fileName = str(tmpdir.join("thresholds.dat"))
+    table = thresholdTable.from_columns(["P211", "P211", "P212", "P212", "P213"], [0, 1, 0, 1, 0],
+                                        [0.8, np.nan, 1.25, 0.5, 0.75],
+                                        ["", "run 2/batch 1", "it's", " padded", "\"quoted\""])
+    table.write(fileName)
+    for line in open(fileName):
+        assert not line.endswith(" \n")
+
+    read = thresholdTable.read(fileName)
+    assert read.rows["run"].tolist() == ["", "run 2/batch 1", "it's", " padded", "\"quoted\""]
+    assert read.rows["ID"].tolist() == ["P211", "P211", "P212", "P212", "P213"]
+    assert read.rows["channel"].tolist() == [0, 1, 0, 1, 0]
+    assert np.array_equal(read.found, table.found)
+    assert np.array_equal(read.rows["Vcrit"][read.found], table.rows["Vcrit"][table.found])
+
+def test_read_plain_thresholds_file(tmpdir):
+    fileName = str(tmpdir.join("thresholds.dat"))
+    with open(fileName, "w") as f:
+        f.write("# ID channel Vcrit\nP211  0\t0.8\n\nP211 1 nan\n")
+
+    read = thresholdTable.read(fileName, run = "run2")
+    assert read.rows["ID"].tolist() == ["P211", "P211"]
+    assert read.rows["run"].tolist() == ["run2", "run2"]
+    assert read.rows["Vcrit"][0] == 0.8
+
+    open(fileName, "w").close()
+    assert len(thresholdTable.read(fileName)) == 0
@@ -0,0 +1,11 @@
+import numpy as np
+
+from utils import quadratic_model
+
+def test_quadratic_model_takes_lists_and_scalars():
+    expected = np.maximum(0, -np.array([0.5, 1.0, 3.0])**2 + 2*np.array([0.5, 1.0, 3.0]))
+
+    assert np.allclose(quadratic_model([0.5, 1.0, 3.0], -1., 2., 0.), expected)
+    assert np.allclose(quadratic_model([1, 2], -1, 2, 0), [1, 0])
+    assert np.allclose(quadratic_model(np.array([0.5, 1.0, 3.0]), -1., 2., 0.), expected)
+    assert quadratic_model(1.0, -1., 2., 0.) == 1.
@@ -0,0 +1,62 @@
+import os
+
+import numpy as np
+
+from watch import fileTail, runWatcher
+
+def write(fileName, text, mtime):
+    with open(fileName, "w") as f:
+        f.write(text)
+    os.utime(fileName, (mtime, mtime))
+
+def test_tail_reads_appended_lines(tmpdir):
+    fileName = str(tmpdir.join("run.dat"))
+    tail = fileTail(fileName)
+    write(fileName, "a 1\nb 2\nc", 1000)
+    assert tail.read_lines() == (["a 1", "b 2"], False)
+    assert tail.read_lines() == ([], False)
+
+    with open(fileName, "a") as f:
+        f.write(" 3\nd 4\n")
+    assert tail.read_lines() == (["c 3", "d 4"], False)
+
+def test_tail_restarts_on_rewrite(tmpdir):
+    fileName = str(tmpdir.join("run.dat"))
+    tail = fileTail(fileName)
+    write(fileName, "a 1\nb 2\n", 1000)
+    tail.read_lines()
+
+    # truncated and written again, past the old offset, on the same inode
+    inode = os.stat(fileName).st_ino
+    write(fileName, "x 1\ny 2\nz 3\n", 1001)
+    assert os.stat(fileName).st_ino == inode
+    assert tail.read_lines() == (["x 1", "y 2", "z 3"], True)
+
+    # rewritten to the same size
+    write(fileName, "x 1\ny 2\nz 4\n", 1002)
+    assert tail.read_lines() == (["x 1", "y 2", "z 4"], True)
+
+def test_tail_reads_in_bounded_blocks(tmpdir):
+    fileName = str(tmpdir.join("run.dat"))
+    tail = fileTail(fileName)
+    write(fileName, "a 1\nb 2\na long line\nc", 1000)
+    assert tail.read_lines(5) == (["a 1"], False)
+    assert tail.read_lines(5) == (["b 2"], False)
+    # a line longer than the block is read whole
+    assert tail.read_lines(5) == (["a long line"], False)
+    assert tail.read_lines(5) == ([], False)
+
+    with open(fileName, "a") as f:
+        f.write(" 3\n")
+    assert tail.read_lines(5) == (["c 3"], False)
+
+def test_watcher_blocks_match_one_read(syntheticFile, tmpdir):
+    directory = tmpdir.mkdir("run")
+    directory.join("batch.dat").write(open(syntheticFile).read())
+
+    whole = runWatcher(str(directory))
+    blocks = runWatcher(str(directory), blockBytes = 2**16)
+    assert whole.poll() == blocks.poll()
+    assert blocks.tails[str(directory.join("batch.dat"))].offset == os.path.getsize(syntheticFile)
+    for key in whole.fits:
+        assert np.allclose(whole.fits[key]["Vcrit"], blocks.fits[key]["Vcrit"], equal_nan = True)
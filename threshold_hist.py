@@ -2,46 +2,48 @@ import numpy as np
 import matplotlib as mpl
 import matplotlib.pyplot as plt
 
+from thresholds import thresholdTable
+
 mpl.rc('font', family = 'FreeSerif', size = 16, weight = 'bold')
 mpl.rc('text', usetex = True)
 plt.ticklabel_format(style='sci', axis='y', scilimits=(0,0))
 
-data = np.loadtxt("../data/thresholds.dat", dtype = str)
-cleaned = [[id, int(channel), float(thresh)]
-           for id, channel, thresh
-           in data if thresh != 'nan']
+table = thresholdTable.read("../data/thresholds.dat")
 
 bins = np.linspace(0, 1.5, 31)
 
+# the counts of each chip and channel in every bin, counted once
+chips, chipCounts = table.histogram(bins, by = "ID")
+channels, channelCounts = table.histogram(bins, by = "channel")
+
 ids = ["P211", "A1537", "A2910", "A2653"]
 for id in ids:
-    plt.hist([i[2] for i in cleaned if i[0] == id], bins = bins, histtype = 'step', label = id)
+    counts = chipCounts[chips["ID"] == id].sum(axis = 0)
+    plt.hist(bins[:-1], bins = bins, weights = counts, histtype = 'step', label = id)
 
-plt.hist([i[2] for i in cleaned], bins = bins, histtype = 'step', label = "Total", color = "black")
+plt.hist(bins[:-1], bins = bins, weights = chipCounts.sum(axis = 0), histtype = 'step', label = "Total", color = "black")
 
 plt.xlabel(r'$V_{\mathrm{crit}}$ [V]')
 plt.legend()
 plt.show()
 
-plt.hist2d([i[1] for i in cleaned],
-           [i[2] for i in cleaned],
-           bins = (range(17), bins))
+counts = np.zeros((16, len(bins) - 1))
+inRange = (channels["channel"] >= 0) & (channels["channel"] < 16)
+counts[channels["channel"][inRange]] = channelCounts[inRange]
+plt.pcolormesh(range(17), bins, counts.T)
 plt.colorbar()
 plt.xlabel(r'Channel')
 plt.ylabel(r'$V_{\mathrm{crit}}$ [V]')
 plt.tight_layout()
 plt.show()
 
-chips = [list(np.unique(data[:,0])).index(i[0]) for i in cleaned]
-plt.hist2d(chips,
-           [i[2] for i in cleaned],
-           bins = (range(len(np.unique(data[:,0]))+1), bins))
+plt.pcolormesh(range(len(chips) + 1), bins, chipCounts.T)
 plt.colorbar()
 plt.xlabel(r'Chip')
-plt.xticks(range(len(np.unique(data[:,0]))), np.unique(data[:,0]), rotation = 'vertical')
+plt.xticks(range(len(chips)), chips["ID"], rotation = 'vertical')
 plt.ylabel(r'$V_{\mathrm{crit}}$ [V]')
 plt.tight_layout()
 plt.show()
 
-# plt.hist([i[0] for i in cleaned], bins = np.unique(data[:,0]))
-# plt.show()
+for row in table.summary("ID"):
+    print row["ID"], row["found"], "of", row["n"], "channels, median Vcrit", row["median"], "V"
@@ -0,0 +1,197 @@
+import json
+
+import numpy as np
+
+from coldAna import header_table
+
+# the fields of a thresholdTable
+thresholdKeys = ["run",        # str, which run (or data file) the result comes from
+                 "ID",         # str, chip ID
+                 "channel",    # int
+                 "Vcrit"]      # float, in V, nan where no Vcrit was found
+
+# the fields of thresholdTable.summary, after the group keys
+summaryKeys = ["n", "found", "mean", "std", "min", "median", "max"]
+
+def bin_indices(values, bins):
+    """
+    the bin of each value, counted the same way as np.histogram (the last bin includes
+    its right edge), or -1 for values outside of the bins and nan
+    """
+    bins = np.asarray(bins, dtype = float)
+    values = np.asarray(values, dtype = float)
+    nBins = len(bins) - 1
+    with np.errstate(invalid = "ignore"):
+        index = np.searchsorted(bins, values, side = "right") - 1
+        index[values == bins[-1]] = nBins - 1
+        index[(index < 0) | (index >= nBins) | ~np.isfinite(values)] = -1
+    return index
+
+def quote_run(run):
+    """
+    the run as written in the last column of a thresholds file: unchanged, or as a JSON string
+    if it would not read back as it is (empty, with whitespace at either end or a line break,
+    or starting with a quote)
+    """
+    if run and run == run.strip() and not "\n" in run and not run.startswith('"'):
+        return run
+    return json.dumps(run)
+
+def unquote_run(text):
+    "the run from the rest of a line of a thresholds file after the first three columns"
+    text = text.strip()
+    if text.startswith('"'):
+        return str(json.loads(text))
+    return text
+
+class thresholdTable(object):
+    """
+    a table of Vcrit results, one row per run, chip and channel, kept as a structured array
+    (rows) with the fields in thresholdKeys.  Statistics and histograms are computed for every
+    group at once from integer group codes and bin counts
+    """
+    def __init__(self, rows):
+        self.rows = rows
+
+    @classmethod
+    def from_columns(cls, ID, channel, Vcrit, run = ""):
+        "make a table from columns of chip IDs, channels and Vcrit (run can be one value or a column)"
+        Vcrit = np.asarray(Vcrit, dtype = float)
+        run = np.asarray(run, dtype = str)
+        if not run.ndim:
+            run = np.full(len(Vcrit), run, dtype = run.dtype)
+        return cls(header_table({"run": run,
+                                 "ID": np.asarray(ID, dtype = str),
+                                 "channel": np.asarray(channel, dtype = int),
+                                 "Vcrit": Vcrit},
+                                thresholdKeys))
+
+    @classmethod
+    def from_vcrit(cls, fits, chips, channels, run = ""):
+        """
+        make a table from the result of extract_vcrit (or resultsStore.vcrit), or just its
+        Vcrit array, with shape (chip, channel) for the given chips and channels
+        """
+        Vcrit = fits["Vcrit"] if isinstance(fits, dict) else fits
+        return cls.from_columns(np.repeat(chips, len(channels)),
+                                np.tile(channels, len(chips)),
+                                np.ravel(Vcrit),
+                                run)
+
+    @classmethod
+    def read(cls, fileName, run = None):
+        """
+        read a table written by write, or a plain thresholds file with the columns
+        ID, channel and Vcrit (with the run set to run, or to the file name).
+        The first three columns are split on whitespace and the rest of the line is the run
+        (see quote_run).  Lines starting with # are skipped
+        """
+        if run is None:
+            run = fileName
+        with open(fileName) as inFile:
+            lines = [line.split(None, 3) for line in inFile]
+        lines = [fields for fields in lines if fields and not fields[0].startswith("#")]
+        return cls.from_columns([fields[0] for fields in lines],
+                                np.array([fields[1] for fields in lines]).astype(int),
+                                np.array([fields[2] for fields in lines]).astype(float),
+                                [unquote_run(fields[3]) if len(fields) >= 4 else run for fields in lines])
+
+    def write(self, fileName):
+        """
+        write the table as text: ID, channel, Vcrit and run on each line, with the run quoted
+        where it could not be read back as it is (see quote_run)
+        """
+        with open(fileName, "w") as outFile:
+            for run, chip, channel, Vcrit in self.rows.tolist():
+                outFile.write(" ".join([chip, str(channel), repr(Vcrit), quote_run(run)]) + "\n")
+
+    @staticmethod
+    def concatenate(tables):
+        "join the rows of several tables into one"
+        return thresholdTable(header_table({key: np.concatenate([table.rows[key] for table in tables])
+                                            for key in thresholdKeys},
+                                           thresholdKeys))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def select(self, **fields):
+        "the table of the rows whose fields are equal to all of the given values"
+        mask = np.ones(len(self), dtype = bool)
+        for key, value in fields.items():
+            mask &= self.rows[key] == value
+        return thresholdTable(self.rows[mask])
+
+    @property
+    def found(self):
+        "mask of the rows where a Vcrit was found"
+        return np.isfinite(self.rows["Vcrit"])
+
+    def group(self, by):
+        """
+        the groups of rows with the same values of one or more fields: returns a structured
+        array of the values of each group (sorted) and the group of each row
+        """
+        keys = [by] if isinstance(by, str) else list(by)
+        uniques = []
+        codes = []
+        for key in keys:
+            values, keyCodes = np.unique(self.rows[key], return_inverse = True)
+            uniques.append(values)
+            codes.append(keyCodes)
+
+        shape = tuple(max(len(values), 1) for values in uniques)
+        groupCodes, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse = True)
+        cells = np.unravel_index(groupCodes, shape)
+        names = header_table({key: values[cell] for key, values, cell in zip(keys, uniques, cells)}, keys)
+
+        return names, inverse
+
+    def histogram(self, bins, by = None):
+        """
+        the counts of found Vcrit in each bin.  With by (a field or list of fields),
+        returns the values of each group (see group) and the counts with shape (group, bin)
+        """
+        nBins = len(bins) - 1
+        index = bin_indices(self.rows["Vcrit"], bins)
+        inBins = index >= 0
+        if by is None:
+            return np.bincount(index[inBins], minlength = nBins)
+
+        names, inverse = self.group(by)
+        counts = np.bincount(inverse[inBins]*nBins + index[inBins], minlength = len(names)*nBins)
+        return names, counts.reshape(len(names), nBins)
+
+    def summary(self, by):
+        """
+        statistics of Vcrit in each group (see group): a structured array with the group's values
+        followed by the fields in summaryKeys, i.e. the number of rows and of found Vcrit, and
+        the mean, standard deviation, minimum, median and maximum of the found ones (nan if none)
+        """
+        names, inverse = self.group(by)
+        nGroups = len(names)
+        found = self.found
+        Vcrit = self.rows["Vcrit"][found]
+        codes = inverse[found]
+
+        n = np.bincount(inverse, minlength = nGroups)
+        nFound = np.bincount(codes, minlength = nGroups)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            mean = np.bincount(codes, weights = Vcrit, minlength = nGroups)/nFound
+            std = np.sqrt(np.bincount(codes, weights = (Vcrit - mean[codes])**2, minlength = nGroups)/nFound)
+
+        # sorted by group, then by Vcrit, so each group's order statistics are at fixed offsets
+        ordered = Vcrit[np.lexsort((Vcrit, codes))]
+        starts = np.cumsum(nFound) - nFound
+        some = nFound > 0
+        minimum = np.full(nGroups, np.nan)
+        median = np.full(nGroups, np.nan)
+        maximum = np.full(nGroups, np.nan)
+        minimum[some] = ordered[starts[some]]
+        maximum[some] = ordered[starts[some] + nFound[some] - 1]
+        median[some] = (ordered[starts[some] + (nFound[some] - 1)//2] + ordered[starts[some] + nFound[some]//2])/2.
+
+        columns = {key: names[key] for key in names.dtype.names}
+        columns.update({"n": n, "found": nFound, "mean": mean, "std": std,
+                        "min": minimum, "median": median, "max": maximum})
+        return header_table(columns, list(names.dtype.names) + summaryKeys)
@@ -1,39 +1,310 @@
+import multiprocessing
+import multiprocessing.pool
+
 import numpy as np
 import scipy.optimize as opt
 
-def fit_model(x, y, model, c0, bounds = None):
+from profiling import profiled
+
+def least_squares_bounds(bounds, nParams):
+    """
+    convert bounds in the style of fmin_l_bfgs_b (a list of (min, max) pairs, with None for
+    no bound) to the (lower, upper) arrays used by least_squares
+    """
+    if bounds is None:
+        bounds = nParams*[(None, None)]
+    lower = np.array([-np.inf if low is None else low for low, high in bounds], dtype = float)
+    upper = np.array([np.inf if high is None else high for low, high in bounds], dtype = float)
+    return lower, upper
+
+def solve_least_squares(residuals, jacobian, starts, bounds):
+    """
+    minimize the sum of squares of residuals(args) within bounds, starting from whichever
+    of the starting points (moved inside the bounds if needed) has the lowest cost.
+    Returns the scipy OptimizeResult, which reports a failure instead of raising
+    if the residuals are not finite at any of the starting points
+    """
+    lower, upper = least_squares_bounds(bounds, len(starts[0]))
+    best = None
+    for start in starts:
+        start = np.clip(np.asarray(start, dtype = float), lower, upper)
+        cost = np.sum(residuals(start)**2)
+        if np.isfinite(cost) and (best is None or cost < best[1]):
+            best = (start, cost)
+
+    if best is None:
+        return opt.OptimizeResult(x = np.clip(np.asarray(starts[0], dtype = float), lower, upper),
+                                  cost = np.nan,
+                                  nfev = len(starts),
+                                  status = -1,
+                                  success = False,
+                                  message = "residuals are not finite at the initial guess")
+
+    return opt.least_squares(residuals, best[0], jac = jacobian, bounds = (lower, upper))
+
+def array_model(model, x, c0):
+    """
+    the model itself if it can be evaluated on the whole array x at once (tried with the
+    parameters c0), otherwise the model wrapped by np.vectorize, for models written for
+    one scalar t at a time (which raise on an array, e.g. from an if or math.exp)
+    """
+    try:
+        np.asarray(model(x, *c0), dtype = float)
+    except (TypeError, ValueError):
+        return np.vectorize(model, otypes = [float])
+    return model
+
+@profiled("fit_model")
+def fit_model(x, y, model, c0, bounds = None, jac = None, full_output = False):
     """
     fit a given function of the form f(t, c1, c2, ...) with initial guess values for c1, c2...
+    model is evaluated on the whole array of t at once, or one t at a time if it rejects arrays
+    (see array_model).  jac(t, c1, c2, ...) should return
+    the derivatives of the model with respect to c1, c2, ... with shape (len(t), number of c's);
+    by default model.jacobian is used if the model has one, otherwise finite differences.
+    If the model has a guess(t, y, lower, upper) function, the fit starts from
+    its guess instead of c0 when that is closer to the data.
+    If full_output is True, the OptimizeResult of the fit is returned as well
     """
-    def chi2(args):
-        return sum((model(xi, *args) - yi)**2 for xi, yi in zip(x, y))
-    
-    bfargs = opt.fmin_l_bfgs_b(chi2, c0, approx_grad = True, bounds = bounds)[0]
-    return bfargs
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    jac = jac or getattr(model, "jacobian", None)
+    starts = [c0]
+    if hasattr(model, "guess"):
+        starts.append(model.guess(x, y, *least_squares_bounds(bounds, len(c0))))
+    model = array_model(model, x, c0)
+
+    def residuals(args):
+        return model(x, *args) - y
+
+    if jac:
+        jacobian = lambda args: jac(x, *args)
+    else:
+        jacobian = "2-point"
+
+    result = solve_least_squares(residuals, jacobian, starts, bounds)
+    if full_output:
+        return result.x, result
+    return result.x
 
-def fit_coupled_models(x1, x2, y1, y2, model, constraint, c0, bounds = None):
+@profiled("fit_coupled_models")
+def fit_coupled_models(x1, x2, y1, y2, model, constraint, c0, bounds = None, jac = None, full_output = False):
     """
     fit a given function of the form f(t, c1, c2, ..., cn) with initial 
     guess values for c1, c2, ..., cn-1
-    to two separate data sets, where the parameters are constrained by some function
+    to two separate data sets, where the parameters are constrained by some function.
+    Analytic derivatives are used if the model has a jacobian (or jac is given, as in fit_model)
+    and constraint.jacobian gives the derivatives of both parameter sets with respect to its arguments.
+    If the constraint has a guess(t1, t2, y1, y2, lower, upper) function, the fit
+    starts from its guess instead of c0 when that is closer to the data
     """
+    x1, x2, y1, y2 = (np.asarray(a, dtype = float) for a in (x1, x2, y1, y2))
+    jac = jac or getattr(model, "jacobian", None)
+    model = array_model(model, x1, constraint(*c0)[0])
+    constraintJacobian = getattr(constraint, "jacobian", None)
 
-    def chi2(args):
+    def residuals(args):
         params1, params2 = constraint(*args)
-        chi2_1 = sum((model(xi, *params1) - yi)**2 for xi, yi in zip(x1, y1))
-        chi2_2 = sum((model(xi, *params2) - yi)**2 for xi, yi in zip(x2, y2))
+        return np.concatenate((model(x1, *params1) - y1,
+                               model(x2, *params2) - y2))
+
+    if jac and constraintJacobian:
+        def jacobian(args):
+            params1, params2 = constraint(*args)
+            dParams1, dParams2 = constraintJacobian(*args)
+            return np.concatenate((np.dot(jac(x1, *params1), dParams1),
+                                   np.dot(jac(x2, *params2), dParams2)))
+    else:
+        jacobian = "2-point"
+
+    starts = [c0]
+    if hasattr(constraint, "guess"):
+        starts.append(constraint.guess(x1, x2, y1, y2, *least_squares_bounds(bounds, len(c0))))
+
+    result = solve_least_squares(residuals, jacobian, starts, bounds)
+    if full_output:
+        return result.x, result
+    return result.x
+
+@profiled("fit_models")
+def fit_models(x, y, model, c0, bounds = None, jac = None, weights = None,
+               maxIterations = 100, tolerance = 1e-8):
+    """
+    fit a given function of the form f(t, c1, c2, ...) to every row of the 2-D array y at once,
+    starting from c0 (one row of initial guesses per row of y, or one shared by all of them).
+    The model and its jacobian (jac, or model.jacobian, with the same broadcasting as in fit_model)
+    are called with each parameter as a column, so that they are evaluated for all rows together,
+    and every row takes its own Levenberg-Marquardt steps, kept within bounds, until its
+    cost changes by less than tolerance.  weights (1 where a sample counts, 0 where it doesn't)
+    can be given per sample or per row and sample.
+    Returns the parameters, shape (rows, number of c's), and arrays of the sum of squared
+    (weighted) residuals, the number of iterations and whether each fit converged
+    """
+    x = np.asarray(x, dtype = float)
+    y = np.atleast_2d(np.asarray(y, dtype = float))
+    nRows = len(y)
+    params = np.array(np.broadcast_to(np.asarray(c0, dtype = float),
+                                      (nRows, np.shape(c0)[-1])))
+    nParams = params.shape[1]
+    lower, upper = least_squares_bounds(bounds, nParams)
+    params = np.clip(params, lower, upper)
+    if weights is None:
+        weights = np.ones(y.shape)
+    weights = np.broadcast_to(np.asarray(weights, dtype = float), y.shape)
+    jac = jac or getattr(model, "jacobian", None)
+    if not jac:
+        raise ValueError("fit_models needs the jacobian of the model")
+
+    def residuals(args, rows):
+        return (model(x, *args.T[:, :, None]) - y[rows])*weights[rows]
+
+    with np.errstate(invalid = "ignore", over = "ignore"):
+        cost = np.sum(residuals(params, np.arange(nRows))**2, axis = 1)
+    damping = np.full(nRows, 1e-3)
+    iterations = np.zeros(nRows, dtype = int)
+    success = np.zeros(nRows, dtype = bool)
+    active = np.isfinite(cost)
+
+    diagonal = (range(nParams), range(nParams))
+    for iteration in range(maxIterations):
+        rows = np.flatnonzero(active)
+        if not len(rows):
+            break
+        these = params[rows]
+        r = residuals(these, rows)
+        J = jac(x, *these.T[:, :, None])*weights[rows][..., None]
+        system = np.einsum("nti,ntj->nij", J, J)
+        gradient = np.einsum("nti,nt->ni", J, r)
+        system[(slice(None),) + diagonal] += damping[rows, None]*np.maximum(system[(slice(None),) + diagonal], 1e-12)
+        try:
+            step = np.linalg.solve(system, -gradient[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = -np.einsum("nij,nj->ni", np.linalg.pinv(system), gradient)
+
+        trial = np.clip(these + step, lower, upper)
+        with np.errstate(invalid = "ignore", over = "ignore"):
+            trialCost = np.sum(residuals(trial, rows)**2, axis = 1)
+        better = trialCost < cost[rows]
+        converged = ((better & (cost[rows] - trialCost <= tolerance*cost[rows])) |
+                     np.all(np.abs(trial - these) <= tolerance*(np.abs(these) + tolerance), axis = 1))
+        # a row whose damping keeps growing can't go downhill from where it is
+        stuck = damping[rows] > 1e10
 
-        return chi2_1 + chi2_2
-        
-    bfargs = opt.fmin_l_bfgs_b(chi2, c0, approx_grad = True, bounds = bounds)[0]
-    return bfargs
+        params[rows[better]] = trial[better]
+        cost[rows[better]] = trialCost[better]
+        damping[rows] = np.where(better, damping[rows]/3., damping[rows]*3.)
+        iterations[rows] += 1
+        success[rows[converged | stuck]] = True
+        active[rows[converged | stuck]] = False
+
+    return params, cost, iterations, success
 
-@np.vectorize
 def quadratic_model(V, A, B, C):
     """
-    it's a parabola
+    it's a parabola (or zero, where the parabola is negative)
+    """
+    V = np.asarray(V, dtype = float)
+    return np.maximum(0, A*V**2 + B*V + C)
+
+def quadratic_jacobian(V, A, B, C):
+    """
+    derivatives of quadratic_model with respect to A, B and C, with shape (len(V), 3)
+    """
+    V = np.asarray(V, dtype = float)
+    positive = A*V**2 + B*V + C > 0
+    return np.stack((V**2, V, np.ones_like(V)), axis = -1)*positive[..., None]
+
+def quadratic_candidates(V, y, lower, upper, zeros = None):
+    """
+    best fits of quadratic_model to (V, y) within the bounds lower, upper, one for each of
+    the positions in zeros where the parabola is required to cross zero on its way up
+    (or a single unconstrained fit if zeros is None).  Returns the parameters,
+    shape (len(zeros), 3), and the sum of squared residuals of each.
+    The positive part of a downward parabola covers a contiguous run of the points, so the
+    exact least squares parabola (or line) is found for every run, optionally with the points
+    just outside the run pinned to zero, and the candidate closest to the data is kept.
+    This is usually the global minimum of the clipped model
     """
-    return max(0, A*V**2 + B*V + C)
+    V = np.asarray(V, dtype = float)
+    y = np.asarray(y, dtype = float)
+    order = np.argsort(V)
+    V, y = V[order], y[order]
+    n = len(V)
+
+    # normal equations of every run of points V[start:stop], from running sums
+    basis = np.stack((V**2, V, np.ones_like(V)), axis = -1)
+    outer = np.concatenate((np.zeros((1, 3, 3)),
+                            np.cumsum(basis[:, :, None]*basis[:, None, :], axis = 0)))
+    inner = np.concatenate((np.zeros((1, 3)),
+                            np.cumsum(basis*y[:, None], axis = 0)))
+
+    # each run is tried with the 8 combinations of three optional constraints:
+    # A = 0 (a line), and the point to the left or right of the run on the model's zero.
+    # With a given zero crossing, the run starts at the first point past it
+    # and the zero takes the place of the left constraint
+    if zeros is None:
+        start, stop = np.triu_indices(n + 1, 1)
+        start, stop = start[None], stop[None]
+        variants = np.arange(8)
+        zeroRows = np.zeros((1, 3))
+    else:
+        zeros = np.asarray(zeros, dtype = float)
+        start = np.repeat(np.searchsorted(V, zeros, side = "right")[:, None], n, axis = 1)
+        stop = start + np.arange(1, n + 1)
+        variants = np.array([0, 1, 4, 5])
+        zeroRows = np.stack((zeros**2, zeros, np.ones_like(zeros)), axis = -1)
+    nVariants = len(variants)
+    start = np.repeat(start, nVariants, axis = 1)
+    stop = np.repeat(stop, nVariants, axis = 1)
+    variant = np.tile(variants, start.shape[1]//nVariants)
+    valid = stop <= n
+    stop = stop.clip(max = n)
+
+    constraints = [(np.broadcast_to(variant & 1 > 0, start.shape), np.array([1., 0., 0.])),
+                   ((variant & 2 > 0) & (start > 0), basis[(start - 1).clip(0)]),
+                   ((variant & 4 > 0) & (stop < n), basis[stop.clip(max = n - 1)]),
+                   (np.broadcast_to(zeros is not None, start.shape), zeroRows[:, None])]
+
+    # the (Lagrange multiplier) system of each candidate
+    system = np.zeros(start.shape + (7, 7))
+    rhs = np.zeros(start.shape + (7,))
+    system[..., :3, :3] = outer[stop] - outer[start]
+    rhs[..., :3] = inner[stop] - inner[start]
+    for k, (active, row) in enumerate(constraints):
+        row = np.broadcast_to(row, start.shape + (3,))
+        system[active, 3 + k, :3] = row[active]
+        system[active, :3, 3 + k] = row[active]
+        system[~active, 3 + k, 3 + k] = 1
+    # with a tiny ridge term so that runs with too few points still give an answer,
+    # and a tinier one on the constraints so that redundant constraints can't make it singular
+    ridge = np.maximum(1e-9*np.trace(system[..., :3, :3], axis1 = -2, axis2 = -1), 1e-12)
+    system[..., range(3), range(3)] += ridge[..., None]
+    system[..., range(3, 7), range(3, 7)] -= 1e-12
+    try:
+        params = np.linalg.solve(system, rhs[..., None])[..., :3, 0]
+    except np.linalg.LinAlgError:
+        params = np.einsum("zcij,zcj->zci", np.linalg.pinv(system), rhs)[..., :3]
+
+    # the model being zero everywhere is a candidate too
+    params = np.concatenate((params, np.tile([[[0., 0., -1.]]], (len(params), 1, 1))), axis = 1)
+    params = np.clip(params, lower, upper)
+    cost = np.sum((quadratic_model(V, *params[..., None].transpose(2, 0, 1, 3)) - y)**2, axis = -1)
+    cost[:, :-1][~valid] = np.inf
+    cost = np.where(np.isfinite(cost), cost, np.inf)
+
+    best = np.argmin(cost, axis = 1)
+    rows = np.arange(len(params))
+    return params[rows, best], cost[rows, best]
+
+def quadratic_guess(V, y, lower, upper):
+    """
+    starting point for fitting quadratic_model to (V, y) within the bounds lower, upper:
+    the best of the quadratic_candidates
+    """
+    return quadratic_candidates(V, y, lower, upper)[0][0]
+
+quadratic_model.jacobian = quadratic_jacobian
+quadratic_model.guess = quadratic_guess
 
 def quadratic_solution(A, B, C):
     """
@@ -54,6 +325,204 @@ def quadratic_zero_coupling(A, B, C, D, E):
     F = -D*root**2 - E*root
     return (A, B, C), (D, E, F)
 
+def quadratic_zero_coupling_jacobian(A, B, C, D, E):
+    """
+    derivatives of both parameter sets returned by quadratic_zero_coupling
+    with respect to A, B, C, D and E, as two arrays of shape (3, 5)
+    """
+    root = quadratic_solution(A, B, C)
+    # from A*root**2 + B*root + C = 0
+    slope = 2*A*root + B
+    dRoot = np.array([-root**2, -root, -1, 0, 0])/slope
+
+    dParams1 = np.eye(3, 5)
+    dParams2 = np.zeros((3, 5))
+    dParams2[0, 3] = 1
+    dParams2[1, 4] = 1
+    dParams2[2] = -(2*D*root + E)*dRoot
+    dParams2[2, 3] -= root**2
+    dParams2[2, 4] -= root
+    return dParams1, dParams2
+
+def quadratic_zero_coupling_guess(V1, V2, y1, y2, lower, upper):
+    """
+    starting point for fitting quadratic_model to both data sets through
+    quadratic_zero_coupling, within the bounds lower, upper.
+    The best pair of parabolas through a common zero is found for a range of
+    zero positions around the data, and the pair closest to the data is returned
+    """
+    V1 = np.asarray(V1, dtype = float)
+    V2 = np.asarray(V2, dtype = float)
+    lower2 = np.append(lower[3:], -np.inf)
+    upper2 = np.append(upper[3:], np.inf)
+
+    def best_pairs(zeros):
+        params1 = quadratic_candidates(V1, y1, lower[:3], upper[:3], zeros)[0]
+        params2 = quadratic_candidates(V2, y2, lower2, upper2, zeros)[0]
+        candidates = np.clip(np.concatenate((params1, params2[:, :2]), axis = 1), lower, upper)
+
+        # score each pair as it will actually be fit, with the second zero tied to the first
+        # (pairs without a real zero just score nan)
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            coupled1, coupled2 = np.array([quadratic_zero_coupling(*args) for args in candidates]).transpose(1, 2, 0)
+            cost = (np.sum((quadratic_model(V1, *coupled1[:, :, None]) - y1)**2, axis = -1) +
+                    np.sum((quadratic_model(V2, *coupled2[:, :, None]) - y2)**2, axis = -1))
+        return candidates, np.where(np.isfinite(cost), cost, np.inf)
+
+    # a coarse scan, including the zeros of the two separate fits, and then finer and finer
+    # ones around the best zero so far.  The optimum often has points exactly on the kink
+    # of the clipped model, where least squares gets stuck, so the scan itself has to get close
+    low = min(V1.min(), V2.min())
+    high = max(V1.max(), V2.max())
+    zeros, step = np.linspace(low - (high - low)/2, high, 32, retstep = True)
+    for V, y, bounds in ((V1, y1, (lower[:3], upper[:3])), (V2, y2, (lower2, upper2))):
+        with np.errstate(invalid = "ignore", divide = "ignore"):
+            zero = quadratic_solution(*quadratic_guess(V, y, *bounds))
+        if np.isfinite(zero):
+            zeros = np.append(zeros, zero)
+    candidates, cost = best_pairs(zeros)
+    best = np.argmin(cost)
+    guess, guessCost, bestZero = candidates[best], cost[best], zeros[best]
+
+    for level in range(4):
+        zeros, newStep = np.linspace(bestZero - step, bestZero + step, 17, retstep = True)
+        candidates, cost = best_pairs(zeros)
+        best = np.argmin(cost)
+        if cost[best] < guessCost:
+            guess, guessCost, bestZero = candidates[best], cost[best], zeros[best]
+        step = newStep
+    return guess
+
+quadratic_zero_coupling.jacobian = quadratic_zero_coupling_jacobian
+quadratic_zero_coupling.guess = quadratic_zero_coupling_guess
+
+def fit_vcrit(V, leftArea, rightArea, leftMask, rightMask):
+    """
+    find Vcrit, the shared zero crossing of parabolas fit to the left and right lobe areas
+    of one channel as a function of the pulser voltage V, using only the voltages in
+    leftMask and rightMask for each lobe.
+    Returns Vcrit, the parameters of both parabolas and the OptimizeResult of the coupled fit
+    """
+    bounds = [(None, 0), (None, None), (None, None)]
+    leftV, leftData = V[leftMask], leftArea[leftMask]
+    rightV, rightData = V[rightMask], np.abs(rightArea[rightMask])
+
+    leftArgs = fit_model(leftV, leftData, quadratic_model, [1, 1, 1], bounds = bounds)
+    rightArgs = fit_model(rightV, rightData, quadratic_model, [1, 1, 1], bounds = bounds)
+    bf, result = fit_coupled_models(leftV, rightV, leftData, rightData,
+                                    quadratic_model, quadratic_zero_coupling,
+                                    np.concatenate((leftArgs, rightArgs[:-1])),
+                                    bounds = bounds + bounds[:2],
+                                    full_output = True)
+
+    leftArgs, rightArgs = quadratic_zero_coupling(*bf)
+    return quadratic_solution(*leftArgs), leftArgs, rightArgs, result
+
+def fit_vcrit_job(job):
+    "fit_vcrit on a tuple of its arguments, for the workers of extract_vcrit"
+    return fit_vcrit(*job)
+
+@profiled("extract_vcrit")
+def extract_vcrit(V, leftA, rightA, hasLedge, leftLobe, rightLobe, visited = None,
+                  executor = "serial", nWorkers = None, chunkSize = 8):
+    """
+    fit Vcrit (see fit_vcrit) for every chip and channel at once.  The arguments
+    are arrays of shape (chip, channel, len(V)) like the ones returned by
+    waveformCollection.ledge_areas: a voltage is used for a lobe if it has no ledge,
+    or a ledge with that lobe.  If visited (of the same shape) is given, only the voltages
+    where it is True are used (see waveformCollection.scan_vcrit).
+    Channels without any left lobe area get Vcrit nan.
+    executor is "serial", "threads" or "processes", with nWorkers workers
+    (default: one per CPU) handed chunkSize fits at a time.
+
+    Returns a dict of arrays with shape (chip, channel): Vcrit, the parameters
+    leftArgs and rightArgs (with a last axis of 3), and the diagnostics chi2 (the sum of
+    squared residuals of the coupled fit), nfev, status and success of each fit
+    """
+    V = np.asarray(V, dtype = float)
+    leftA, rightA = np.asarray(leftA), np.asarray(rightA)
+    hasLedge, leftLobe, rightLobe = (np.asarray(a, dtype = bool) for a in (hasLedge, leftLobe, rightLobe))
+    leftMask = ~hasLedge | (hasLedge & leftLobe)
+    rightMask = ~hasLedge | (hasLedge & rightLobe)
+    if visited is not None:
+        visited = np.asarray(visited, dtype = bool)
+        leftMask &= visited
+        rightMask &= visited
+
+    shape = leftA.shape[:-1]
+    result = {"Vcrit": np.full(shape, np.nan),
+              "leftArgs": np.full(shape + (3,), np.nan),
+              "rightArgs": np.full(shape + (3,), np.nan),
+              "chi2": np.full(shape, np.nan),
+              "nfev": np.zeros(shape, dtype = int),
+              "status": np.zeros(shape, dtype = int),
+              "success": np.zeros(shape, dtype = bool)}
+
+    cells = [cell for cell in np.ndindex(*shape) if np.any(leftA[cell] != 0)]
+    jobs = [(V, leftA[cell], rightA[cell], leftMask[cell], rightMask[cell]) for cell in cells]
+
+    if executor == "serial":
+        fits = [fit_vcrit(*job) for job in jobs]
+    elif executor in ("threads", "processes"):
+        if executor == "threads":
+            pool = multiprocessing.pool.ThreadPool(nWorkers)
+        else:
+            pool = multiprocessing.Pool(nWorkers)
+        try:
+            fits = pool.map(fit_vcrit_job, jobs, chunkSize)
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        raise ValueError("unknown executor " + str(executor))
+
+    for cell, (Vcrit, leftArgs, rightArgs, fit) in zip(cells, fits):
+        result["Vcrit"][cell] = Vcrit
+        result["leftArgs"][cell] = leftArgs
+        result["rightArgs"][cell] = rightArgs
+        result["chi2"][cell] = 2*fit.cost
+        result["nfev"][cell] = fit.nfev
+        result["status"][cell] = fit.status
+        result["success"][cell] = fit.success
+    return result
+
+# the order n of the CR-RC^n response of the shaper
+shaperOrder = 4
+
+def shaper_model(t, A, t0, tp, B):
+    """
+    the CR-RC^n response of the shaper (n = shaperOrder) to a pulse starting at t0,
+    peaking tp after it with a height of A above the baseline B
+    """
+    u = np.clip((np.asarray(t, dtype = float) - t0)/tp, 0, None)
+    return B + A*u**shaperOrder*np.exp(shaperOrder*(1 - u))
+
+def shaper_jacobian(t, A, t0, tp, B):
+    """
+    derivatives of shaper_model with respect to A, t0, tp and B, with shape (len(t), 4)
+    (or (rows, len(t), 4) when the parameters are columns, as in fit_models)
+    """
+    n = shaperOrder
+    u = np.clip((np.asarray(t, dtype = float) - t0)/tp, 0, None)
+    shape = u**n*np.exp(n*(1 - u))
+    dU = A*n*u**(n - 1)*(1 - u)*np.exp(n*(1 - u))
+    return np.stack(np.broadcast_arrays(shape, -dU/tp, -dU*u/tp, np.ones_like(u)), axis = -1)
+
+def shaper_guess(t, y, lower, upper, peakingTime = 8.):
+    """
+    starting point for fitting shaper_model to (t, y) within the bounds lower, upper:
+    the pulse peaks at the largest sample, peakingTime ticks after it starts,
+    on a baseline given by the first 5% of the samples
+    """
+    t = np.asarray(t, dtype = float)
+    y = np.asarray(y, dtype = float)
+    baseline = np.mean(y[:max(int(0.05*len(y)), 1)])
+    peak = np.argmax(y)
+    return np.clip([y[peak] - baseline, t[peak] - peakingTime, peakingTime, baseline], lower, upper)
+
+shaper_model.jacobian = shaper_jacobian
+shaper_model.guess = shaper_guess
+
 def hex_to_bin(n, digits = 2):
     """convert a hex string to a list of its digits in binary representation"""
     result = []
@@ -66,3 +535,8 @@ def hex_to_bin(n, digits = 2):
         result.append((base10 >> place) & 1)
 
     return result
+
+def hex_to_int(column):
+    """convert an array of hex strings to an array of ints, parsing each distinct string only once"""
+    values, inverse = np.unique(column, return_inverse = True)
+    return np.array([int(value, 16) for value in values], dtype = int)[inverse]
@@ -0,0 +1,205 @@
+import os
+import sys
+import time
+import fnmatch
+import argparse
+
+from coldData import *
+from thresholds import thresholdTable
+
+class fileTail(object):
+    """
+    the complete lines appended to a growing file since it was last read, found by byte offset.
+    A line is only read once its newline has been written, so a waveform which the DAQ
+    is still writing is left for the next read
+    """
+    def __init__(self, fileName, checkBytes = 4096):
+        """
+        the last checkBytes bytes read (at least 1) are kept, to tell whether the file was
+        rewritten in place, rather than appended to, since the last read
+        """
+        self.fileName = fileName
+        self.checkBytes = checkBytes
+        self.offset = 0
+        self.inode = None
+        # the inode, size and modification time of the file when it was last read to the end
+        self.seen = None
+        # the bytes just before offset
+        self.checked = b""
+
+    def read_lines(self, maxBytes = None):
+        """
+        returns the new complete lines and whether the file was replaced, truncated or
+        rewritten since the last read, in which case it is read again from the start.
+        If maxBytes is given, only the lines within the next maxBytes bytes are read (or the
+        next line, if it is longer), and the rest are left for the following reads.
+        A rewrite is found by a new inode, a size below the offset, or bytes before the
+        offset which differ from the ones read, which are only compared once the size or
+        modification time has changed
+        """
+        stat = os.stat(self.fileName)
+        seen = (stat.st_ino, stat.st_size, stat.st_mtime)
+        if seen == self.seen:
+            return [], False
+
+        restarted = (self.inode is not None and stat.st_ino != self.inode) or stat.st_size < self.offset
+        with open(self.fileName, "rb") as f:
+            if not restarted and self.checked:
+                f.seek(self.offset - len(self.checked))
+                restarted = f.read(len(self.checked)) != self.checked
+            if restarted:
+                self.offset = 0
+                self.checked = b""
+            f.seek(self.offset)
+            remaining = max(stat.st_size - self.offset, 0)
+            data = f.read(remaining if maxBytes is None else min(remaining, maxBytes))
+            while len(data) < remaining and data.rfind(b"\n") < 0:
+                data += f.read(min(remaining - len(data), maxBytes))
+        self.inode = stat.st_ino
+        # only a file which was read to the end can be skipped until it changes
+        self.seen = seen if len(data) == remaining else None
+
+        complete = data[:data.rfind(b"\n") + 1]
+        self.offset += len(complete)
+        self.checked = (self.checked + complete)[-self.checkBytes:]
+        if not isinstance(complete, str):
+            complete = complete.decode("ascii")
+
+        return complete.splitlines(), restarted
+
+class runWatcher(object):
+    """
+    analyses the DAQ files in a directory tree as they are written: each poll reads only the
+    lines appended to each file since the last one (see fileTail), blockBytes at a time so that
+    a long backlog is not held in memory at once, searches their waveforms for
+    ledges and refits Vcrit (see utils.extract_vcrit) for just the chips and channels which got
+    new waveforms.  Each file is a separate run, and a later waveform with the same chip,
+    channel and pulser magnitude replaces an earlier one
+    """
+    def __init__(self, directory, pattern = "*.dat", headerSize = 13, thresholdsFile = None,
+                 chunkSize = 64, blockBytes = 64*2**20, **parameters):
+        """
+        the files under directory whose names match pattern are watched.  If thresholdsFile
+        is given, the thresholdTable of every channel is written there after each update.
+        parameters override the ledgeParameters of the search
+        """
+        self.directory = directory
+        self.pattern = pattern
+        self.headerSize = headerSize
+        self.thresholdsFile = thresholdsFile
+        self.chunkSize = chunkSize
+        self.blockBytes = blockBytes
+        self.parameters = parameters
+
+        self.tails = {}
+        # (file, ID, channel): {ExtPulserMag: (leftA, rightA, hasLedge, leftLobe, rightLobe)}
+        self.points = {}
+        # (file, ID, channel): the extract_vcrit result of the channel, with one value per field
+        self.fits = {}
+
+    def files(self):
+        "the sorted names of the watched files which exist now"
+        found = []
+        for root, dirs, names in os.walk(self.directory):
+            found += [os.path.join(root, name) for name in fnmatch.filter(names, self.pattern)]
+        return sorted(found)
+
+    @profiled("watch.analyze")
+    def analyze(self, fileName, lines):
+        "search new lines of a file for ledges, returning the set of (file, ID, channel) they belong to"
+        headers, samples = dataFile(fileName, self.headerSize).parse(lines)
+        if not len(headers):
+            return set()
+
+        collection = waveformCollection(store = waveformStore(headers, samples))
+        collection.find_ledge(chunkSize = self.chunkSize, **self.parameters)
+        leftA, rightA = collection.lobe_areas(self.chunkSize)
+        store = collection.store
+
+        updated = set()
+        for i, (chip, channel, pulserMag) in enumerate(zip(headers["ID"], headers["channel"], headers["ExtPulserMag"])):
+            key = (fileName, str(chip), int(channel))
+            self.points.setdefault(key, {})[float(pulserMag)] = (leftA[i], rightA[i], store.hasLedge[i],
+                                                                 store.leftLobe[i], store.rightLobe[i])
+            updated.add(key)
+
+        return updated
+
+    def refit(self, key):
+        "fit Vcrit again for one (file, ID, channel) from all of its waveforms so far"
+        points = self.points[key]
+        V = np.array(sorted(points))
+        leftA, rightA, hasLedge, leftLobe, rightLobe = (np.array(column)[None, None]
+                                                        for column in zip(*[points[v] for v in V]))
+        fits = extract_vcrit(V, leftA, rightA, hasLedge, leftLobe, rightLobe)
+        self.fits[key] = {name: values[0, 0] for name, values in fits.items()}
+
+    @profiled("watch.poll")
+    def poll(self):
+        """
+        read and analyse whatever has been appended to the watched files since the last poll,
+        refitting the channels which changed (and writing the thresholds file, if any).
+        Returns the sorted list of the (file, ID, channel) which were refit
+        """
+        updated = set()
+        for fileName in self.files():
+            tail = self.tails.setdefault(fileName, fileTail(fileName))
+            while True:
+                try:
+                    lines, restarted = tail.read_lines(self.blockBytes)
+                except (IOError, OSError):
+                    break
+                if restarted:
+                    for key in [key for key in self.points if key[0] == fileName]:
+                        del self.points[key]
+                        self.fits.pop(key, None)
+                        updated.discard(key)
+                if not lines:
+                    break
+                updated |= self.analyze(fileName, lines)
+
+        for key in updated:
+            self.refit(key)
+        if updated and self.thresholdsFile:
+            self.table().write(self.thresholdsFile)
+
+        return sorted(updated)
+
+    def table(self):
+        "the thresholdTable of every channel seen so far, with each file as its run"
+        keys = sorted(self.fits)
+        return thresholdTable.from_columns([chip for fileName, chip, channel in keys],
+                                           [channel for fileName, chip, channel in keys],
+                                           [self.fits[key]["Vcrit"] for key in keys],
+                                           [os.path.relpath(fileName, self.directory)
+                                            for fileName, chip, channel in keys])
+
+    def run(self, interval = 2., once = False, out = sys.stdout):
+        """
+        poll every interval seconds until interrupted (or just once), printing the new Vcrit of
+        each channel which changed, along with the number of pulser magnitudes it has so far
+        """
+        while True:
+            for key in self.poll():
+                fileName, chip, channel = key
+                out.write(" ".join([os.path.relpath(fileName, self.directory), chip, str(channel),
+                                    str(self.fits[key]["Vcrit"]), "(" + str(len(self.points[key])), "V)"]) + "\n")
+            out.flush()
+            if once:
+                break
+            time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "analyse DAQ files as they are written")
+    parser.add_argument("directory", help = "the run directory to watch, e.g. run2")
+    parser.add_argument("--pattern", default = "*.dat", help = "names of the files to watch")
+    parser.add_argument("--thresholds", default = None, help = "file to keep the Vcrit of every channel in")
+    parser.add_argument("--interval", type = float, default = 2., help = "seconds between polls")
+    parser.add_argument("--once", action = "store_true", help = "analyse what is there and exit")
+    args = parser.parse_args()
+
+    watcher = runWatcher(args.directory, args.pattern, thresholdsFile = args.thresholds)
+    try:
+        watcher.run(args.interval, args.once)
+    except KeyboardInterrupt:
+        pass